@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Headless entry point: nothing here imports Qt, and figures are rendered by
+# the Agg backend
+import matplotlib
+matplotlib.use('Agg')
+
+from diarization_metrics import diarization_error, format_metrics, speaker_stats
+from segment_export import export_segments
+from session import load_session
+from matplotlib.figure import Figure
+from waveform_core import (
+    LRUCache,
+    MemoryBudget,
+    draw_waveform,
+    get_audio_duration,
+    load_rttm_index,
+    load_view,
+    plot_waveform,
+    read_audio_range,
+    split_audio_and_rttm,
+)
+
+
+def output_name(job, fmt):
+    name = os.path.splitext(os.path.basename(job["wav"]))[0]
+    if job["start"] is not None or job["end"] is not None:
+        end = f"{job['end']:g}" if job['end'] is not None else 'end'
+        name += f"_{job['start'] or 0:g}-{end}"
+    return f"{name}.{fmt}"
+
+
+def render_job(job, output, dpi=100, memory_budget=None):
+    # Runs in a worker process. Errors are reported in the result instead of
+    # raised, so one bad file does not stop the batch. With a memory budget
+    # in bytes, the view is prepared as in the GUI's low-memory mode instead
+    # of decoding the whole window.
+    timings = {}
+    result = {"wav": job["wav"], "rttm": job["rttm"], "output": output, "timings": timings}
+    started = time.perf_counter()
+    try:
+        stage_started = time.perf_counter()
+        total_duration = get_audio_duration(job["wav"])
+        start_time = job["start"] if job["start"] is not None else 0.0
+        end_time = min(job["end"], total_duration) if job["end"] is not None else total_duration
+        if start_time >= end_time:
+            raise ValueError(f"empty window {start_time}-{end_time} for a {total_duration:.2f}s file")
+
+        if memory_budget is None:
+            y, sr, y_start_time = read_audio_range(job["wav"], start_time, end_time)
+            timings["decode"] = time.perf_counter() - stage_started
+
+            stage_started = time.perf_counter()
+            rttm_index = load_rttm_index(job["rttm"])
+            y, sr, segments = split_audio_and_rttm(y, sr, rttm_index, start_time, end_time - start_time,
+                                                   y_start_time, total_duration)
+            timings["index"] = time.perf_counter() - stage_started
+
+            stage_started = time.perf_counter()
+            fig = plot_waveform(y, sr, segments, start_time)
+            timings["plot"] = time.perf_counter() - stage_started
+        else:
+            fig = Figure(figsize=(14, 5))
+            ax = fig.subplots()
+            budget = MemoryBudget(memory_budget)
+            data = load_view(job["wav"], job["rttm"], start_time, end_time, ax.get_window_extent().width,
+                             LRUCache(budget.cache_bytes), budget=budget)
+            timings["view"] = time.perf_counter() - stage_started
+
+            stage_started = time.perf_counter()
+            draw_waveform(ax, data)
+            timings["plot"] = time.perf_counter() - stage_started
+
+        stage_started = time.perf_counter()
+        fig.savefig(output, dpi=dpi)
+        timings["save"] = time.perf_counter() - stage_started
+
+        result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+    timings["total"] = time.perf_counter() - started
+    return result
+
+
+def render_manifest(jobs, output_dir, fmt='png', workers=None, dpi=100, memory_budget=None):
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Two rows of the same recording must not overwrite each other's image
+    outputs = []
+    used = set()
+    for i, job in enumerate(jobs):
+        name = output_name(job, fmt)
+        if name in used:
+            name = f"{os.path.splitext(name)[0]}_{i}.{fmt}"
+        used.add(name)
+        outputs.append(os.path.join(output_dir, name))
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(render_job, job, output, dpi, memory_budget) for job, output in zip(jobs, outputs)]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def render_command(args):
+    jobs = load_session(args.manifest)
+    started = time.perf_counter()
+    results = []
+    memory_budget = args.memory_budget * 1024 * 1024 if args.memory_budget else None
+    for result in render_manifest(jobs, args.output, args.format, args.workers, args.dpi, memory_budget):
+        results.append(result)
+        if result["status"] == "ok":
+            print(f"ok      {result['timings']['total']:8.2f}s  {result['output']}")
+        else:
+            print(f"FAILED  {result['timings']['total']:8.2f}s  {result['wav']}: {result['error']}", file=sys.stderr)
+
+    failures = sum(result["status"] != "ok" for result in results)
+    print(f"{len(results) - failures} rendered, {failures} failed in {time.perf_counter() - started:.2f}s")
+
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump(results, file, indent=2)
+    return 1 if failures else 0
+
+
+def metrics_command(args):
+    hypothesis = load_rttm_index(args.rttm)
+    stats = speaker_stats(hypothesis, args.start, args.end)
+    errors = None
+    if args.reference:
+        errors = diarization_error(load_rttm_index(args.reference), hypothesis, args.start, args.end)
+    print(format_metrics(stats, errors))
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({"rttm": args.rttm, "reference": args.reference, "stats": stats, "errors": errors}, file, indent=2)
+    return 0
+
+
+def export_command(args):
+    rttm_index = load_rttm_index(args.rttm)
+    started = time.perf_counter()
+    summary = export_segments(args.wav, rttm_index, args.output, args.per_label, args.start, args.end, args.workers)
+    print(f"Wrote {summary['files']} files ({summary['seconds']:.1f}s of audio) to {args.output} "
+          f"in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless tools for WAV/RTTM diarization output.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    render = commands.add_parser('render', help="Render the waveform of every manifest row to an image.")
+    render.add_argument('manifest', help="CSV file with wav,rttm[,start,end] rows, or a folder of WAV files with "
+                                         "RTTM files of the same name")
+    render.add_argument('-o', '--output', default='renders', help="directory for the images (default: renders)")
+    render.add_argument('-f', '--format', default='png', choices=['png', 'svg'])
+    render.add_argument('-j', '--workers', type=int, default=None, help="worker processes (default: one per core)")
+    render.add_argument('--dpi', type=int, default=100)
+    render.add_argument('--report', help="write per-file timings and failures to this JSON file")
+    render.add_argument('--memory-budget', type=int, metavar='MIB',
+                        help="low-memory mode: keep the audio data of each worker within this many MiB")
+    render.set_defaults(func=render_command)
+
+    metrics = commands.add_parser('metrics', help="Print speaking time, overlap and DER/JER of an RTTM file.")
+    metrics.add_argument('rttm', help="RTTM file to measure (the hypothesis when --reference is given)")
+    metrics.add_argument('-r', '--reference', help="reference RTTM to compute DER and JER against")
+    metrics.add_argument('--start', type=float, default=None, help="start of the window in seconds (default: first turn)")
+    metrics.add_argument('--end', type=float, default=None, help="end of the window in seconds (default: last turn)")
+    metrics.add_argument('--json', help="also write the metrics to this JSON file")
+    metrics.set_defaults(func=metrics_command)
+
+    export = commands.add_parser('export', help="Write the audio of every RTTM turn, or of every label, to WAV files.")
+    export.add_argument('wav', help="audio file the turns are cut from")
+    export.add_argument('rttm', help="RTTM file with the turns")
+    export.add_argument('-o', '--output', default='segments', help="directory for the WAV files (default: segments)")
+    export.add_argument('--per-label', action='store_true',
+                        help="write one track per label with all of its speech instead of one clip per turn")
+    export.add_argument('--start', type=float, default=None, help="only export turns after this time in seconds")
+    export.add_argument('--end', type=float, default=None, help="only export turns before this time in seconds")
+    export.add_argument('-j', '--workers', type=int, default=None, help="writer threads (default: chosen by Python)")
+    export.set_defaults(func=export_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Runs headless: only the Qt-free helpers are imported and figures are
+# rendered by the Agg backend
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import soundfile as sf
+
+from diarization_metrics import diarization_error, speaker_stats
+from segment_export import export_segments
+from waveform_core import (
+    LRUCache,
+    MemoryBudget,
+    RTTMIndex,
+    build_file_pyramid,
+    draw_waveform,
+    load_rttm_index,
+    load_segment_store,
+    load_view,
+    open_rttm_index,
+    parse_rttm,
+    plot_waveform,
+    rasterize_waveform,
+    read_audio_range,
+    split_audio_and_rttm,
+)
+from matplotlib.figure import Figure
+
+# Audio durations in seconds and RTTM turn counts for each preset
+PRESETS = {
+    "quick": {"durations": [60, 600], "turns": [10, 1000, 100000]},
+    "full": {"durations": [60, 600, 3600, 36000], "turns": [10, 1000, 100000, 1000000]},
+}
+# Length of the window used by the windowed stages, in seconds
+WINDOW = 30.0
+# Decoding a whole file is only benchmarked up to this duration
+MAX_FULL_DECODE = 3600
+# Clip export writes one file per turn, so it is only benchmarked up to this
+# many turns
+MAX_EXPORT_TURNS = 10000
+# Frames written per block while generating synthetic audio
+GENERATE_BLOCK = 1 << 20
+
+
+def synthetic_wav(work_dir, duration, sr):
+    # Noise with a slowly varying loudness, streamed to disk block by block.
+    # Files are reused between runs when they already exist.
+    filename = os.path.join(work_dir, f"synthetic_{duration}s_{sr}hz.wav")
+    if os.path.exists(filename):
+        return filename
+    rng = np.random.default_rng(duration)
+    n_frames = int(duration * sr)
+    partial = filename + ".part"
+    with sf.SoundFile(partial, 'w', sr, 1, 'PCM_16', format='WAV') as audio_file:
+        for offset in range(0, n_frames, GENERATE_BLOCK):
+            n = min(GENERATE_BLOCK, n_frames - offset)
+            t = (offset + np.arange(n)) / sr
+            gain = 0.2 + 0.15 * np.sin(2 * np.pi * t / 7.0)
+            audio_file.write((rng.standard_normal(n) * gain).astype(np.float32))
+    os.replace(partial, filename)
+    return filename
+
+
+def synthetic_rttm(work_dir, n_turns, span, n_speakers):
+    # n_turns turns spread over span seconds, with some overlap between them
+    filename = os.path.join(work_dir, f"synthetic_{n_turns}turns_{int(span)}s_{n_speakers}spk.rttm")
+    if os.path.exists(filename):
+        return filename
+    rng = np.random.default_rng(n_turns)
+    starts = np.sort(rng.uniform(0, span, n_turns))
+    durations = rng.exponential(1.5 * span / n_turns, n_turns)
+    speakers = rng.integers(0, n_speakers, n_turns)
+    partial = filename + ".part"
+    with open(partial, 'w') as file:
+        for start, duration, speaker in zip(starts.tolist(), durations.tolist(), speakers.tolist()):
+            file.write(f"SPEAKER synthetic 1 {start:.3f} {duration:.3f} <NA> <NA> spk{speaker:02d} <NA> <NA>\n")
+    os.replace(partial, filename)
+    return filename
+
+
+def measure(func, repeat):
+    # Best wall time over `repeat` untraced runs, then one run under
+    # tracemalloc for the peak of memory allocated during the stage
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def render_to_buffer(fig, fmt='png'):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt)
+    return buffer.getbuffer().nbytes
+
+
+def stage_cases(wavs, rttms, sr, work_dir, stages=None):
+    # Yields (stage, parameters, callable) for every benchmarked case. With
+    # stages, the untimed setup of the other stages is skipped too, since it
+    # can take longer than the stages that are run.
+    def wanted(*names):
+        return stages is None or any(name in stages for name in names)
+
+    for duration, wav in wavs.items():
+        middle = max(duration / 2 - WINDOW / 2, 0.0)
+        yield "decode_window", {"duration": duration}, lambda wav=wav, middle=middle: read_audio_range(wav, middle, middle + WINDOW)
+        if duration <= MAX_FULL_DECODE:
+            yield "decode_full", {"duration": duration}, lambda wav=wav: read_audio_range(wav)
+        yield "file_pyramid", {"duration": duration}, lambda wav=wav: build_file_pyramid(wav)
+
+    # Whole-file views in low-memory mode, from an empty cache every time.
+    # The fewest turns keep the RTTM out of the measurement.
+    budget = MemoryBudget()
+    rttm = rttms[min(rttms)]
+    for duration, wav in wavs.items():
+        def low_memory_view(wav=wav):
+            return load_view(wav, rttm, None, None, 1000, LRUCache(budget.cache_bytes), budget=budget)
+        yield "low_memory_view", {"duration": duration}, low_memory_view
+
+    for n_turns, rttm in rttms.items():
+        yield "parse_rttm", {"turns": n_turns}, lambda rttm=rttm: parse_rttm(rttm)
+        if wanted("open_segment_store"):
+            # Writes the store on first use, then maps it
+            open_rttm_index(rttm)
+            yield "open_segment_store", {"turns": n_turns}, lambda rttm=rttm: load_segment_store(rttm)
+
+    for n_turns, rttm in rttms.items():
+        if not wanted("speaker_stats", "diarization_error", "export_clips"):
+            break
+        rttm_index = parse_rttm(rttm)
+        yield "speaker_stats", {"turns": n_turns}, lambda rttm_index=rttm_index: speaker_stats(rttm_index)
+        # Scored against a copy of itself with every turn moved by 100 ms
+        shifted = RTTMIndex(rttm_index.starts + 0.1, rttm_index.durations, rttm_index.codes, rttm_index.labels)
+        yield "diarization_error", {"turns": n_turns}, lambda rttm_index=rttm_index, shifted=shifted: diarization_error(rttm_index, shifted)
+
+        # One clip per turn cut from the longest recording, which the turns
+        # span. Later runs overwrite the clips of the first.
+        if n_turns <= MAX_EXPORT_TURNS:
+            wav = wavs[max(wavs)]
+            output_dir = os.path.join(work_dir, "exported")
+            yield "export_clips", {"turns": n_turns}, lambda rttm_index=rttm_index, wav=wav: export_segments(wav, rttm_index, output_dir)
+
+    for duration, wav in wavs.items():
+        if not wanted("split_audio_and_rttm", "render_window", "render_full", "rasterize_full"):
+            break
+        middle = max(duration / 2 - WINDOW / 2, 0.0)
+        y, _, y_start_time = read_audio_range(wav, middle, middle + WINDOW)
+        pyramid = build_file_pyramid(wav) if wanted("render_full", "rasterize_full") else None
+        for n_turns, rttm in rttms.items():
+            # The cache holds the parsed RTTM, so render_full times the view only
+            cache = LRUCache()
+            rttm_index = load_rttm_index(rttm, cache)
+            params = {"duration": duration, "turns": n_turns}
+
+            def split(y=y, y_start_time=y_start_time, rttm_index=rttm_index, middle=middle, duration=duration):
+                return split_audio_and_rttm(y, sr, rttm_index, middle, WINDOW, y_start_time, duration)
+            yield "split_audio_and_rttm", params, split
+
+            def render_window(split=split, middle=middle):
+                window, _, segments = split()
+                return render_to_buffer(plot_waveform(window, sr, segments, middle))
+            yield "render_window", params, render_window
+
+            def render_full(wav=wav, rttm=rttm, cache=cache, pyramid=pyramid):
+                # Whole-file view from the file pyramid, as the GUI draws it
+                fig = Figure(figsize=(14, 5))
+                ax = fig.subplots()
+                data = load_view(wav, rttm, None, None, ax.get_window_extent().width, cache, pyramid)
+                draw_waveform(ax, data)
+                return render_to_buffer(fig)
+            yield "render_full", params, render_full
+
+            def rasterize_full(wav=wav, rttm=rttm, cache=cache, pyramid=pyramid):
+                # The same view through the raster engine of the GUI, up to
+                # the image it paints
+                fig = Figure(figsize=(14, 5))
+                bbox = fig.subplots().get_window_extent()
+                data = load_view(wav, rttm, None, None, bbox.width, cache, pyramid)
+                return rasterize_waveform(data, round(bbox.width), round(bbox.height), fig.dpi)
+            yield "rasterize_full", params, rasterize_full
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the parse, slice and render stages on synthetic recordings.")
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='quick',
+                        help="quick: 1-10 minutes and up to 100k turns; full: up to 10 hours and 1M turns")
+    parser.add_argument('--durations', type=int, nargs='+', help="audio durations in seconds (overrides the preset)")
+    parser.add_argument('--turns', type=int, nargs='+', help="RTTM turn counts (overrides the preset)")
+    parser.add_argument('--speakers', type=int, default=32, help="number of speaker labels in each RTTM")
+    parser.add_argument('--sample-rate', type=int, default=16000)
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per case, the best one is kept")
+    parser.add_argument('--stages', nargs='+', help="only run these stages")
+    parser.add_argument('--work-dir', help="where synthetic inputs are generated and kept (default: a temporary directory)")
+    parser.add_argument('-o', '--output', default='benchmark_results.json')
+    args = parser.parse_args(argv)
+
+    durations = args.durations or PRESETS[args.preset]["durations"]
+    turns = args.turns or PRESETS[args.preset]["turns"]
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='awd-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+
+    print(f"Generating inputs in {work_dir}")
+    wavs = {duration: synthetic_wav(work_dir, duration, args.sample_rate) for duration in durations}
+    rttms = {n_turns: synthetic_rttm(work_dir, n_turns, max(durations), args.speakers) for n_turns in turns}
+
+    results = []
+    for stage, params, func in stage_cases(wavs, rttms, args.sample_rate, work_dir, args.stages):
+        if args.stages and stage not in args.stages:
+            continue
+        seconds, peak = measure(func, args.repeat)
+        results.append({"stage": stage, **params, "seconds": seconds, "peak_bytes": peak})
+        described = ", ".join(f"{key}={value:g}" for key, value in params.items())
+        print(f"{stage:22s} {described:32s} {seconds * 1000:10.1f} ms {peak / 2 ** 20:10.1f} MiB")
+
+    report = {
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "matplotlib": matplotlib.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "sample_rate": args.sample_rate,
+        "window": WINDOW,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
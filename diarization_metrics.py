@@ -0,0 +1,355 @@
+import os
+
+import numpy as np
+
+from waveform_core import file_identity, load_rttm_index
+
+# Speaking time, overlap and DER/JER computed on the columnar RTTMIndex
+# arrays. Turns are first merged into disjoint intervals per label; a sorted
+# sweep over the interval boundaries then counts the labels talking between
+# every two consecutive boundaries, and a join on interval starts finds the
+# time each pair of labels talks together. Nothing here loops over turns or
+# intervals in Python.
+
+def _window_bounds(start_time, end_time):
+    return (-np.inf if start_time is None else start_time,
+            np.inf if end_time is None else end_time)
+
+def label_intervals(rttm_index, start_time=None, end_time=None):
+    # Turns of every label merged into disjoint intervals and clipped to the
+    # window. Returns (starts, ends, codes) ordered by start.
+    start_time, end_time = _window_bounds(start_time, end_time)
+    indices = rttm_index.query(start_time, end_time)
+    starts = np.maximum(rttm_index.starts[indices], start_time)
+    ends = np.maximum(np.minimum(rttm_index.starts[indices] + rttm_index.durations[indices], end_time), starts)
+    codes = rttm_index.codes[indices]
+    if len(starts) == 0:
+        return starts, ends, codes
+
+    # The index is sorted by start, and a stable sort keeps that order
+    # within each label
+    order = np.argsort(codes, kind='stable')
+    starts, ends, codes = starts[order], ends[order], codes[order]
+
+    # Shifting each label by more than the whole time span lets one running
+    # maximum over all turns find where every label's turns stop overlapping
+    origin = starts.min()
+    shift = (ends.max() - origin + 1.0) * codes
+    reach = np.maximum.accumulate(ends - origin + shift)
+    first = np.empty(len(starts), dtype=bool)
+    first[0] = True
+    first[1:] = starts[1:] - origin + shift[1:] > reach[:-1]
+    begins = np.flatnonzero(first)
+    starts, ends, codes = starts[begins], np.maximum.reduceat(ends, begins), codes[begins]
+
+    # Back in time order; each label is already a sorted run, which the
+    # stable sort merges quickly
+    order = np.argsort(starts, kind='stable')
+    return starts[order], ends[order], codes[order]
+
+def _turn_count(rttm_index, start_time, end_time):
+    return len(rttm_index.query(*_window_bounds(start_time, end_time)))
+
+def _extent(start_time, end_time, *intervals):
+    # The window actually covered: the given bounds, or the extent of the turns
+    starts = np.concatenate([interval[0] for interval in intervals])
+    ends = np.concatenate([interval[1] for interval in intervals])
+    if start_time is None:
+        start_time = float(starts.min()) if len(starts) else 0.0
+    if end_time is None:
+        end_time = float(ends.max()) if len(ends) else start_time
+    return start_time, end_time
+
+# Bits per set in the packed counts of _active_counts. A set never has more
+# intervals active at once than it has labels.
+COUNT_BITS = 16
+
+def _active_counts(*interval_sets):
+    # Sweep over the boundaries of up to four sets of (starts, ends, codes)
+    # intervals. Returns the start and length of every elementary interval
+    # between two consecutive boundaries and, for each set, how many of its
+    # intervals cover it. The counts of all sets are packed in one int64 so
+    # that a single cumulative sum tracks them.
+    times = np.concatenate([np.concatenate([intervals[0], intervals[1]]) for intervals in interval_sets])
+    steps = np.concatenate([
+        np.repeat(np.array([1, -1], dtype=np.int64) << (COUNT_BITS * column), [len(starts), len(ends)])
+        for column, (starts, ends, _) in enumerate(interval_sets)
+    ])
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    packed = np.cumsum(steps[order])[:-1]
+    counts = [(packed >> (COUNT_BITS * column)) & ((1 << COUNT_BITS) - 1) for column in range(len(interval_sets))]
+    return times[:-1], np.diff(times), counts
+
+def speaker_stats(rttm_index, start_time=None, end_time=None):
+    # Speaking time per label, total speech and overlapped speech in seconds
+    intervals = label_intervals(rttm_index, start_time, end_time)
+    starts, ends, codes = intervals
+    speaking = np.bincount(codes, weights=ends - starts, minlength=len(rttm_index.labels))
+    _, lengths, (active,) = _active_counts(intervals)
+
+    turns = _turn_count(rttm_index, start_time, end_time)
+    start_time, end_time = _extent(start_time, end_time, intervals)
+    return {
+        "start": start_time,
+        "end": end_time,
+        "turns": turns,
+        "speech": float(lengths[active >= 1].sum()),
+        "overlap": float(lengths[active >= 2].sum()),
+        "labels": {label: float(speaking[code]) for code, label in enumerate(rttm_index.labels) if speaking[code] > 0},
+    }
+
+def _ranges(lo, hi):
+    # Concatenation of arange(lo[k], hi[k]) for every k
+    counts = hi - lo
+    return np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+def interval_pairs(first, second):
+    # Every pair (i, j) of an interval of first overlapping one of second,
+    # with the start and end of their intersection. Both are (starts, ends,
+    # codes) sorted by start, as label_intervals returns them. A pair
+    # overlaps when either interval starts inside the other, so both cases
+    # are found with searchsorted on the starts.
+    first_starts, first_ends, _ = first
+    second_starts, second_ends, _ = second
+
+    lo = np.searchsorted(second_starts, first_starts, side='left')
+    hi = np.maximum(np.searchsorted(second_starts, first_ends, side='left'), lo)
+    i = np.repeat(np.arange(len(first_starts)), hi - lo)
+    j = _ranges(lo, hi)
+
+    lo = np.searchsorted(first_starts, second_starts, side='right')
+    hi = np.maximum(np.searchsorted(first_starts, second_ends, side='left'), lo)
+    i = np.concatenate([i, _ranges(lo, hi)])
+    j = np.concatenate([j, np.repeat(np.arange(len(second_starts)), hi - lo)])
+
+    starts = np.maximum(first_starts[i], second_starts[j])
+    ends = np.minimum(first_ends[i], second_ends[j])
+    keep = ends > starts
+    return i[keep], j[keep], starts[keep], ends[keep]
+
+def best_assignment(weights):
+    # Pairs (row, column) maximising the summed weight, each row and column
+    # used at most once (Hungarian algorithm). Speaker counts are small, so
+    # the O(n^3) loop is cheap.
+    weights = np.asarray(weights, dtype=np.float64)
+    transposed = weights.shape[0] > weights.shape[1]
+    cost = -(weights.T if transposed else weights)
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=np.intp)
+    way = np.zeros(m + 1, dtype=np.intp)
+    for i in range(1, n + 1):
+        owner[0] = i
+        j0 = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = owner[j0]
+            free = np.flatnonzero(~used[1:]) + 1
+            slack = cost[i0 - 1, free - 1] - u[i0] - v[free]
+            better = slack < min_slack[free]
+            min_slack[free[better]] = slack[better]
+            way[free[better]] = j0
+            j1 = free[np.argmin(min_slack[free])]
+            delta = min_slack[j1]
+            u[owner[used]] += delta
+            v[used] -= delta
+            min_slack[~used] -= delta
+            j0 = j1
+            if owner[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            owner[j0] = owner[j1]
+            j0 = j1
+    pairs = [(owner[j] - 1, j - 1) for j in range(1, m + 1) if owner[j]]
+    return sorted((column, row) for row, column in pairs) if transposed else sorted(pairs)
+
+def _overlap_matrix(ref_intervals, hyp_intervals, n_ref, n_hyp):
+    # Time each reference label talks together with each hypothesis label
+    i, j, starts, ends = interval_pairs(ref_intervals, hyp_intervals)
+    return np.bincount(ref_intervals[2][i].astype(np.intp) * n_hyp + hyp_intervals[2][j],
+                       weights=ends - starts, minlength=n_ref * n_hyp).reshape(n_ref, n_hyp)
+
+def diarization_error(reference, hypothesis, start_time=None, end_time=None):
+    # DER and JER of hypothesis against reference (both RTTMIndex), with no
+    # forgiveness collar and overlapped speech scored
+    ref_intervals = label_intervals(reference, start_time, end_time)
+    hyp_intervals = label_intervals(hypothesis, start_time, end_time)
+    _, lengths, (n_ref_active, n_hyp_active) = _active_counts(ref_intervals, hyp_intervals)
+
+    n_ref = len(reference.labels)
+    n_hyp = len(hypothesis.labels)
+    overlap = _overlap_matrix(ref_intervals, hyp_intervals, n_ref, n_hyp)
+    ref_time = np.bincount(ref_intervals[2], weights=ref_intervals[1] - ref_intervals[0], minlength=n_ref)
+    hyp_time = np.bincount(hyp_intervals[2], weights=hyp_intervals[1] - hyp_intervals[0], minlength=n_hyp)
+
+    # DER maps speakers to maximise the total matched time, which is then
+    # the correctly attributed part of the time both sides talk
+    mapping = {r: h for r, h in best_assignment(overlap) if overlap[r, h] > 0}
+    correct = sum(overlap[r, h] for r, h in mapping.items())
+    scored = float(np.dot(lengths, n_ref_active))
+    missed = float(np.dot(lengths, np.maximum(n_ref_active - n_hyp_active, 0)))
+    false_alarm = float(np.dot(lengths, np.maximum(n_hyp_active - n_ref_active, 0)))
+    confusion = float(np.dot(lengths, np.minimum(n_ref_active, n_hyp_active))) - correct
+
+    # JER maps them to maximise the summed Jaccard index of each pair
+    union = ref_time[:, None] + hyp_time[None, :] - overlap
+    jaccard = np.divide(overlap, union, out=np.zeros(overlap.shape), where=union > 0)
+    jaccard_mapping = {r: h for r, h in best_assignment(jaccard) if jaccard[r, h] > 0}
+    speakers = {}
+    for r, label in enumerate(reference.labels):
+        if ref_time[r] <= 0:
+            continue
+        h = jaccard_mapping.get(r)
+        speakers[label] = {
+            "time": float(ref_time[r]),
+            "hypothesis": hypothesis.labels[h] if h is not None else None,
+            "jer": 1.0 - float(jaccard[r, h]) if h is not None else 1.0,
+        }
+
+    start_time, end_time = _extent(start_time, end_time, ref_intervals, hyp_intervals)
+    return {
+        "start": start_time,
+        "end": end_time,
+        "scored": scored,
+        "missed": missed,
+        "false_alarm": false_alarm,
+        "confusion": confusion,
+        "der": (missed + false_alarm + confusion) / scored if scored > 0 else None,
+        "jer": float(np.mean([speaker["jer"] for speaker in speakers.values()])) if speakers else None,
+        "mapping": {reference.labels[r]: hypothesis.labels[h] for r, h in mapping.items()},
+        "speakers": speakers,
+    }
+
+def speaker_mapping(reference, hypothesis):
+    # Reference code -> hypothesis code over the whole files, as DER maps them
+    n_ref = len(reference.labels)
+    n_hyp = len(hypothesis.labels)
+    overlap = _overlap_matrix(label_intervals(reference), label_intervals(hypothesis), n_ref, n_hyp)
+    return {r: h for r, h in best_assignment(overlap) if overlap[r, h] > 0}
+
+ERROR_KINDS = ("missed", "false_alarm", "confusion")
+
+def _runs(starts, lengths, flags):
+    # Consecutive elementary intervals with the flag set, joined into regions
+    edges = np.diff(flags.astype(np.int8), prepend=0, append=0)
+    begins = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1) - 1
+    return starts[begins], starts[stops] + lengths[stops]
+
+def error_regions(reference, hypothesis, mapping, start_time=None, end_time=None):
+    # Where the hypothesis misses speech, adds speech or gives speech to the
+    # wrong speaker, as (starts, ends) of merged regions for each of
+    # ERROR_KINDS. mapping comes from speaker_mapping, so that panning does
+    # not change which speakers are matched.
+    ref_intervals = label_intervals(reference, start_time, end_time)
+    hyp_intervals = label_intervals(hypothesis, start_time, end_time)
+
+    # Intersections of matched speakers are the correctly attributed speech
+    mapped = np.full(len(reference.labels), -1, dtype=np.int64)
+    for r, h in mapping.items():
+        mapped[r] = h
+    i, j, starts, ends = interval_pairs(ref_intervals, hyp_intervals)
+    matched = mapped[ref_intervals[2][i]] == hyp_intervals[2][j]
+    correct_intervals = (starts[matched], ends[matched], None)
+
+    times, lengths, (n_ref, n_hyp, n_correct) = _active_counts(ref_intervals, hyp_intervals, correct_intervals)
+    flags = {
+        "missed": n_ref > n_hyp,
+        "false_alarm": n_hyp > n_ref,
+        "confusion": np.minimum(n_ref, n_hyp) > n_correct,
+    }
+    return {kind: _runs(times, lengths, flags[kind]) for kind in ERROR_KINDS}
+
+def lane_bars(starts, ends, codes, min_gap):
+    # Intervals of each label with the gaps shorter than min_gap closed, so
+    # that a lane never holds many more bars per label than there are pixels
+    order = np.argsort(codes, kind='stable')
+    starts, ends, codes = starts[order], ends[order], codes[order]
+    if len(starts) == 0:
+        return starts, ends, codes
+    first = np.empty(len(starts), dtype=bool)
+    first[0] = True
+    first[1:] = (codes[1:] != codes[:-1]) | (starts[1:] - ends[:-1] >= min_gap)
+    begins = np.flatnonzero(first)
+    return starts[begins], np.maximum.reduceat(ends, begins), codes[begins]
+
+def _clip_regions(starts, ends, start_time, end_time):
+    # Regions are disjoint and sorted, so their ends are sorted too
+    lo = np.searchsorted(ends, start_time, side='right')
+    hi = np.searchsorted(starts, end_time, side='left')
+    return np.maximum(starts[lo:hi], start_time), np.minimum(ends[lo:hi], end_time)
+
+def load_error_regions(reference_filename, hypothesis_filename, cache=None):
+    # Error regions over the whole files, kept in the cache so that every
+    # later view only slices them
+    key = ("error_regions", file_identity(reference_filename), file_identity(hypothesis_filename))
+    regions = cache.get(key) if cache is not None else None
+    if regions is None:
+        reference = load_rttm_index(reference_filename, cache)
+        hypothesis = load_rttm_index(hypothesis_filename, cache)
+        regions = error_regions(reference, hypothesis, speaker_mapping(reference, hypothesis))
+        if cache is not None:
+            cache.put(key, regions, sum(starts.nbytes + ends.nbytes for starts, ends in regions.values()))
+    return regions
+
+def load_lanes(filenames, start_time, end_time, pixel_width, cache=None):
+    # Label lanes of several RTTM files over [start_time, end_time), reduced
+    # to about one bar per pixel. The first file is the reference: every
+    # other lane also carries its error regions against it.
+    min_gap = (end_time - start_time) / max(pixel_width, 1)
+    lanes = []
+    for k, filename in enumerate(filenames):
+        rttm_index = load_rttm_index(filename, cache)
+        lane = {
+            "name": os.path.basename(filename),
+            "labels": rttm_index.labels,
+            "bars": lane_bars(*label_intervals(rttm_index, start_time, end_time), min_gap),
+            "errors": None,
+        }
+        if k > 0:
+            lane["errors"] = {}
+            for kind, (starts, ends) in load_error_regions(filenames[0], filename, cache).items():
+                starts, ends = _clip_regions(starts, ends, start_time, end_time)
+                lane["errors"][kind] = lane_bars(starts, ends, np.zeros(len(starts), dtype=np.int32), min_gap)[:2]
+        lanes.append(lane)
+    return lanes
+
+def lane_bar_count(lanes):
+    count = 0
+    for lane in lanes:
+        count += len(lane["bars"][0])
+        if lane["errors"] is not None:
+            count += sum(len(starts) for starts, _ in lane["errors"].values())
+    return count
+
+def _percent(value):
+    return "n/a" if value is None else f"{value * 100:.2f}%"
+
+def format_metrics(stats, errors=None):
+    # Plain-text report shared by the GUI and batch.py
+    lines = [
+        f"Window      {stats['start']:.2f} - {stats['end']:.2f} s",
+        f"Turns       {stats['turns']}",
+        f"Speech      {stats['speech']:.2f} s",
+        f"Overlap     {stats['overlap']:.2f} s ({_percent(stats['overlap'] / stats['speech'] if stats['speech'] else None)} of speech)",
+        "Speaking time per label:",
+    ]
+    for label, seconds in sorted(stats["labels"].items(), key=lambda item: -item[1]):
+        lines.append(f"  {label:16s} {seconds:10.2f} s  {_percent(seconds / stats['speech'])}")
+    if errors is not None:
+        lines += [
+            f"DER         {_percent(errors['der'])} of {errors['scored']:.2f} s scored",
+            f"  missed        {errors['missed']:10.2f} s",
+            f"  false alarm   {errors['false_alarm']:10.2f} s",
+            f"  confusion     {errors['confusion']:10.2f} s",
+            f"JER         {_percent(errors['jer'])}",
+            "Reference -> hypothesis:",
+        ]
+        for label, speaker in errors["speakers"].items():
+            lines.append(f"  {label:16s} -> {speaker['hypothesis'] or '-':16s} JER {_percent(speaker['jer'])}")
+    return "\n".join(lines)
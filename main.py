@@ -1,107 +1,29 @@
-from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QPushButton, QFileDialog, QVBoxLayout, QFrame, QDialog, QLineEdit, QHBoxLayout, QMessageBox
+import time
+STARTED = time.perf_counter()
+
+from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QPushButton, QFileDialog, QVBoxLayout, QFrame, QDialog, QLineEdit, QHBoxLayout, QMessageBox, QCheckBox, QComboBox, QListWidget
 from PyQt5.QtGui import QPixmap, QFont, QFontDatabase
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
+import argparse
 import sys
 import os
-import librosa
-import soundfile as sf
-import matplotlib.pyplot as plt
-import matplotlib
-import matplotlib.cm as cm
-matplotlib.use('Qt5Agg', force=True)
-
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-
-def parse_rttm(filename, segment_start_time):
-    segments = []
-    with open(filename, 'r') as file:
-        for line in file:
-            parts = line.strip().split()
-            start = float(parts[3]) + segment_start_time
-            duration = float(parts[4])
-            label = parts[7]
-            segments.append({"start": start, "duration": duration, "label": label})
-    return segments
-    
-def adjust_alpha(color, alpha_factor=0.8):
-    r, g, b, a = color
-    a = max(a * alpha_factor, 0.0)
-    return (r, g, b, a)
-
-def plot_waveform(y, sr, segments, start_time):
-    # Generate a colormap with a large number of colors
-    num_labels = len(set(segment["label"] for segment in segments))
-    colormap = plt.get_cmap('tab20', num_labels)  
-
-    # Create a dictionary to map each label to a unique color
-    labels = list(set(segment["label"] for segment in segments))
-    colors = {label: colormap(i / num_labels) for i, label in enumerate(labels)}
-
-    fig, ax = plt.subplots(figsize=(14, 5))
-
-    for segment in segments:
-        start_sample = int(segment["start"] * sr)
-        end_sample = int((segment["start"] + segment["duration"]) * sr)
-
-        if end_sample > len(y):
-            end_sample = len(y)
-
-        label = segment["label"]
-        color = colors[label]
-
-        times = librosa.samples_to_time(range(start_sample, end_sample), sr=sr) + start_time
-        ax.plot(times, y[start_sample:end_sample], color=color, alpha=0.8, label=f'{label}')
-
-    full_audio_times = librosa.samples_to_time(range(len(y)), sr=sr) + start_time
-    ax.plot(full_audio_times, y, color='gray', alpha=0.2, label='Full Audio')
-
-    ax.set_title('Waveform')
-    ax.set_xlabel('Time (seconds)')
-    ax.set_ylabel('Amplitude')
-    ax.grid(True)
-
-    # Create a legend with unique labels
-    legend_handles = [plt.Line2D([0], [0], color=colors[label], lw=4, label=f'{label}') for label in colors]
-    ax.legend(handles=legend_handles, loc='upper right')
-
-    return fig
-
-
-def split_audio_and_rttm(y, sr, rttm_lines, start_time, duration):
-    # Calculate the total duration of the audio in seconds
-    total_duration = librosa.get_duration(y=y, sr=sr)
-
-    # Calculate the end time of the segment, ensuring it does not exceed the total duration
-    end_time = min(start_time + duration, total_duration)
-    start_sample = int(start_time * sr)
-    end_sample = int(end_time * sr)
-
-    # Extract the audio segment
-    segment = y[start_sample:end_sample]
-
-    # Initialize an empty list to store the RTTM segments
-    segments = []
-    for line in rttm_lines:
-        parts = line.strip().split()
-        start_time_rttm = float(parts[3])
-        duration_rttm = float(parts[4])
-        end_time_rttm = start_time_rttm + duration_rttm
-
-        # Check if the RTTM segment overlaps with the desired segment
-        if start_time_rttm < end_time and end_time_rttm > start_time:
-            # Calculate the new start time and duration for the segment within the desired time range
-            new_start_time = max(0, start_time_rttm - start_time)
-            new_duration = min(duration_rttm, end_time - start_time_rttm)
-
-            # Append the segment to the list
-            segments.append({
-                "start": new_start_time,
-                "duration": new_duration,
-                "label": parts[7]  
-            })
-
-    return segment, sr, segments
 
+# numpy, soundfile and matplotlib take most of the startup time. They are
+# imported on first use instead of here, and preloaded by LibraryPreloader
+# once the window is shown.
+
+# Mouse navigation: zoom factor per wheel step, smallest visible span in
+# seconds, and how long the view must stay still before it is re-rendered
+ZOOM_STEP = 1.25
+MIN_VIEW_DURATION = 0.01
+VIEW_REFRESH_DELAY_MS = 30
+# Follow mode: how often the files are checked for appended data, and the
+# visible span in seconds when following starts before anything is shown
+FOLLOW_INTERVAL_MS = 250
+FOLLOW_WINDOW = 30.0
+# Recordings after the current one of a session that are prepared in the
+# background
+SESSION_PREFETCH_AHEAD = 3
 
 class CustomInputDialog(QDialog):
     def __init__(self, parent=None):
@@ -271,12 +193,529 @@ class CustomWarningDialog(QDialog):
 
         self.adjustSize()
 
+class MetricsDialog(QDialog):
+    # Non-modal, so that the plot can still be navigated while it is open
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Metrics")
+        self.setMinimumWidth(560)
+        self.setStyleSheet("background-color: black; color: white;")
+
+        layout = QVBoxLayout(self)
+        self.text_label = QLabel("")
+        self.text_label.setStyleSheet("font-family: 'Courier New', monospace; font-size: 9pt; color: white;")
+        self.text_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        layout.addWidget(self.text_label)
+
+        button_style = """
+            QPushButton {
+                background-color: #99ccff; 
+                color: black; 
+                border: 2px solid #99ccff;
+                border-radius: 15px;
+                font-family: 'Verdana'; 
+                font-size: 9pt;
+            }
+            QPushButton:hover {
+                background-color: #80bfff;
+            }
+            QPushButton:pressed {
+                background-color: #6699ff;
+            }
+        """
+        button_layout = QHBoxLayout()
+        self.reference_button = QPushButton("Compare with Reference RTTM")
+        self.reference_button.setFixedSize(230, 30)
+        self.reference_button.setStyleSheet(button_style)
+        self.close_button = QPushButton("Close")
+        self.close_button.setFixedSize(80, 30)
+        self.close_button.setStyleSheet(button_style)
+        button_layout.addWidget(self.reference_button)
+        button_layout.addStretch()
+        button_layout.addWidget(self.close_button)
+        layout.addLayout(button_layout)
+
+        self.close_button.clicked.connect(self.accept)
+
+    def set_text(self, text):
+        self.text_label.setText(text)
+        self.adjustSize()
+
+
+class MetricsWorker(QThread):
+    # Speaking time, overlap and, with a reference RTTM, DER/JER for the
+    # visible window and the whole file
+    loaded = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+    def __init__(self, filename_rttm, filename_reference, cache, window=None, parent=None):
+        super().__init__(parent)
+        self.filename_rttm = filename_rttm
+        self.filename_reference = filename_reference
+        self.cache = cache
+        self.window = window
+
+    def run(self):
+        from diarization_metrics import diarization_error, format_metrics, speaker_stats
+        from waveform_core import load_rttm_index
+
+        try:
+            hypothesis = load_rttm_index(self.filename_rttm, self.cache)
+            reference = load_rttm_index(self.filename_reference, self.cache) if self.filename_reference else None
+            scopes = [("Whole file", (None, None))]
+            if self.window is not None:
+                scopes.insert(0, ("Visible window", self.window))
+
+            sections = []
+            if reference is not None:
+                sections.append(f"Reference: {os.path.basename(self.filename_reference)}")
+            for title, (start_time, end_time) in scopes:
+                stats = speaker_stats(hypothesis, start_time, end_time)
+                errors = diarization_error(reference, hypothesis, start_time, end_time) if reference is not None else None
+                sections.append(f"{title}\n{format_metrics(stats, errors)}")
+            self.loaded.emit("\n\n".join(sections))
+        except Exception as e:
+            self.failed.emit(str(e))
+
+
+class ExportDialog(QDialog):
+    # Options of a segment export, then its progress. Non-modal like the
+    # metrics, and closing it cancels a running export.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Export Segments")
+        self.setMinimumWidth(420)
+        self.setStyleSheet("background-color: black; color: white;")
+
+        layout = QVBoxLayout(self)
+        self.mode_combo = QComboBox()
+        self.mode_combo.addItems(["One clip per turn", "One track per label"])
+        self.mode_combo.setStyleSheet("font-family: 'Arial'; font-size: 9pt; color: white;")
+        layout.addWidget(self.mode_combo)
+        self.window_checkbox = QCheckBox("Only the visible window")
+        self.window_checkbox.setStyleSheet("font-family: 'Arial'; font-size: 9pt; color: white;")
+        layout.addWidget(self.window_checkbox)
+        self.status_label = QLabel("")
+        self.status_label.setStyleSheet("font-family: 'Arial'; font-size: 9pt; color: white;")
+        self.status_label.setWordWrap(True)
+        layout.addWidget(self.status_label)
+
+        button_style = """
+            QPushButton {
+                background-color: #99ccff; 
+                color: black; 
+                border: 2px solid #99ccff;
+                border-radius: 15px;
+                font-family: 'Verdana'; 
+                font-size: 9pt;
+            }
+            QPushButton:hover {
+                background-color: #80bfff;
+            }
+            QPushButton:pressed {
+                background-color: #6699ff;
+            }
+        """
+        button_layout = QHBoxLayout()
+        self.export_button = QPushButton("Export to Folder...")
+        self.export_button.setFixedSize(160, 30)
+        self.export_button.setStyleSheet(button_style)
+        self.close_button = QPushButton("Close")
+        self.close_button.setFixedSize(80, 30)
+        self.close_button.setStyleSheet(button_style)
+        button_layout.addWidget(self.export_button)
+        button_layout.addStretch()
+        button_layout.addWidget(self.close_button)
+        layout.addLayout(button_layout)
+
+        self.close_button.clicked.connect(self.reject)
+
+    def set_status(self, text):
+        self.status_label.setText(text)
+
+
+class SessionDialog(QDialog):
+    # The recordings of a session with their duration, speakers and turns.
+    # Non-modal: selecting a row, or Previous and Next, shows that recording.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Session")
+        self.setMinimumWidth(560)
+        self.setMinimumHeight(360)
+        self.setStyleSheet("background-color: black; color: white;")
+
+        layout = QVBoxLayout(self)
+        self.list_widget = QListWidget()
+        self.list_widget.setStyleSheet("font-family: 'Courier New', monospace; font-size: 9pt; color: white;")
+        layout.addWidget(self.list_widget)
+        self.status_label = QLabel("Open a folder of WAV and RTTM files, or a manifest of wav,rttm rows.")
+        self.status_label.setStyleSheet("font-family: 'Arial'; font-size: 9pt; color: white;")
+        self.status_label.setWordWrap(True)
+        layout.addWidget(self.status_label)
+
+        button_style = """
+            QPushButton {
+                background-color: #99ccff; 
+                color: black; 
+                border: 2px solid #99ccff;
+                border-radius: 15px;
+                font-family: 'Verdana'; 
+                font-size: 9pt;
+            }
+            QPushButton:hover {
+                background-color: #80bfff;
+            }
+            QPushButton:pressed {
+                background-color: #6699ff;
+            }
+        """
+        button_layout = QHBoxLayout()
+        self.folder_button = QPushButton("Open Folder...")
+        self.folder_button.setFixedSize(120, 30)
+        self.manifest_button = QPushButton("Open Manifest...")
+        self.manifest_button.setFixedSize(130, 30)
+        self.previous_button = QPushButton("Previous")
+        self.previous_button.setFixedSize(80, 30)
+        self.next_button = QPushButton("Next")
+        self.next_button.setFixedSize(80, 30)
+        self.close_button = QPushButton("Close")
+        self.close_button.setFixedSize(80, 30)
+        for button in (self.folder_button, self.manifest_button, self.previous_button, self.next_button, self.close_button):
+            button.setStyleSheet(button_style)
+        button_layout.addWidget(self.folder_button)
+        button_layout.addWidget(self.manifest_button)
+        button_layout.addStretch()
+        button_layout.addWidget(self.previous_button)
+        button_layout.addWidget(self.next_button)
+        button_layout.addWidget(self.close_button)
+        layout.addLayout(button_layout)
+
+        self.close_button.clicked.connect(self.accept)
+
+    def set_status(self, text):
+        self.status_label.setText(text)
+
+
+class SessionScanner(QThread):
+    # Reads the summary of every recording of a session, in order. A failed
+    # summary is reported as an "error" entry instead of stopping the scan.
+    summarized = pyqtSignal(int, object)
+
+    def __init__(self, jobs, cache, parent=None):
+        super().__init__(parent)
+        self.jobs = jobs
+        self.cache = cache
+
+    def run(self):
+        from session import recording_summary
+
+        for index, job in enumerate(self.jobs):
+            if self.isInterruptionRequested():
+                return
+            try:
+                summary = recording_summary(job, self.cache)
+            except Exception as e:
+                summary = {"error": str(e)}
+            self.summarized.emit(index, summary)
+
+
+class ExportWorker(QThread):
+    # Writes the audio of the RTTM turns, one clip per turn or one track per
+    # label, to a folder. Stopped through requestInterruption().
+    progress = pyqtSignal(str)
+    loaded = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+    # Files written between two progress messages
+    PROGRESS_STEP = 100
+
+    def __init__(self, filename_wav, filename_rttm, output_dir, per_label, cache, window=None, parent=None):
+        super().__init__(parent)
+        self.filename_wav = filename_wav
+        self.filename_rttm = filename_rttm
+        self.output_dir = output_dir
+        self.per_label = per_label
+        self.cache = cache
+        self.window = window
+
+    def report_progress(self, done, total):
+        if done == total or done % self.PROGRESS_STEP == 0:
+            self.progress.emit(f"Exported {done} of {total} files...")
+
+    def run(self):
+        from segment_export import export_segments
+        from waveform_core import LoadCancelled, load_rttm_index
+
+        try:
+            rttm_index = load_rttm_index(self.filename_rttm, self.cache)
+            start_time, end_time = self.window if self.window is not None else (None, None)
+            started = time.perf_counter()
+            summary = export_segments(self.filename_wav, rttm_index, self.output_dir, self.per_label, start_time, end_time,
+                                      should_stop=self.isInterruptionRequested, progress=self.report_progress)
+            self.loaded.emit(f"Wrote {summary['files']} files ({summary['seconds']:.1f} s of audio) to "
+                             f"{self.output_dir} in {time.perf_counter() - started:.2f} s")
+        except LoadCancelled:
+            pass
+        except Exception as e:
+            self.failed.emit(str(e))
+
+
+class LibraryPreloader(QThread):
+    # Imports the audio and plotting modules while the window is already
+    # usable. Importing them from the GUI thread at the same time just waits
+    # for this thread to finish them.
+    failed = pyqtSignal(str)
+
+    def run(self):
+        try:
+            import waveform_core  # noqa: F401
+            import waveform_canvas  # noqa: F401
+            import diarization_metrics  # noqa: F401
+            import segment_export  # noqa: F401
+            import session  # noqa: F401
+        except Exception as e:
+            self.failed.emit(str(e))
+
+
+class WaveformLoader(QThread):
+    # Runs the decode / index / render pipeline of one view off the GUI thread.
+    # Cancelling is done through requestInterruption(), which is checked
+    # between stages and between decoded blocks.
+    progress = pyqtSignal(str)
+    loaded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, filename_wav, filename_rttm, cache, start_time, end_time, pixel_width, use_sidecar=False, timer=None,
+                 lane_filenames=(), spectrogram_pool=None, budget=None, raster_size=None, parent=None):
+        super().__init__(parent)
+        self.filename_wav = filename_wav
+        self.filename_rttm = filename_rttm
+        self.lane_filenames = list(lane_filenames)
+        # The spectrogram is only computed when a thread pool is given
+        self.spectrogram_pool = spectrogram_pool
+        self.cache = cache
+        self.start_time = start_time
+        self.end_time = end_time
+        self.pixel_width = pixel_width
+        self.use_sidecar = use_sidecar
+        self.timer = timer
+        # A MemoryBudget in low-memory mode
+        self.budget = budget
+        # (width, height, dpi) of the axes when the waveform is rasterized
+        self.raster_size = raster_size
+
+    def run(self):
+        from waveform_core import LoadCancelled, load_file_pyramid, load_view, pyramid_sidecar_path, stage_span
+
+        try:
+            if self.use_sidecar and not os.path.exists(pyramid_sidecar_path(self.filename_wav)):
+                self.progress.emit("Building sidecar cache...")
+            with stage_span(self.timer, "pyramid"):
+                pyramid = load_file_pyramid(self.filename_wav, self.cache, self.use_sidecar, self.isInterruptionRequested,
+                                            budget=self.budget)
+            if self.isInterruptionRequested():
+                return
+
+            data = load_view(self.filename_wav, self.filename_rttm, self.start_time, self.end_time, self.pixel_width,
+                             self.cache, pyramid, self.isInterruptionRequested, self.progress.emit, self.timer, self.budget)
+            if self.isInterruptionRequested():
+                return
+
+            if self.raster_size is not None:
+                from waveform_core import rasterize_waveform
+
+                with stage_span(self.timer, "rasterize"):
+                    data["raster"] = rasterize_waveform(data, *self.raster_size)
+
+            if self.lane_filenames:
+                from diarization_metrics import lane_bar_count, load_lanes
+
+                self.progress.emit("Comparing RTTM files...")
+                with stage_span(self.timer, "lanes") as counters:
+                    data["lanes"] = load_lanes(self.lane_filenames, *data["xlim"], self.pixel_width, self.cache)
+                    counters["bars"] = lane_bar_count(data["lanes"])
+                if self.isInterruptionRequested():
+                    return
+
+            if self.spectrogram_pool is not None:
+                from diarization_metrics import label_intervals, lane_bars
+                from waveform_core import load_rttm_index, spectrogram_view
+
+                self.progress.emit("Computing spectrogram...")
+                with stage_span(self.timer, "spectrogram") as counters:
+                    spectrogram = spectrogram_view(self.filename_wav, *data["xlim"], self.pixel_width, self.cache,
+                                                   self.spectrogram_pool, self.isInterruptionRequested)
+                    rttm_index = load_rttm_index(self.filename_rttm, self.cache)
+                    min_gap = (data["xlim"][1] - data["xlim"][0]) / max(self.pixel_width, 1)
+                    spectrogram["labels"] = rttm_index.labels
+                    spectrogram["bars"] = lane_bars(*label_intervals(rttm_index, *data["xlim"]), min_gap)
+                    counters["tiles"] = spectrogram["tiles"]
+                    counters["computed"] = spectrogram["computed"]
+                data["spectrogram"] = spectrogram
+
+            self.loaded.emit(data)
+        except LoadCancelled:
+            pass
+        except Exception as e:
+            self.failed.emit(str(e))
+
+
+class PrefetchLoader(WaveformLoader):
+    # Prepares a recording of a session before it is shown: builds its
+    # whole-file pyramid, which also serves zooming and panning later, then
+    # loads its first view like any WaveformLoader. The recording it belongs
+    # to and the view options it was loaded with are kept on it.
+    def __init__(self, session_index, options, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session_index = session_index
+        self.options = options
+
+    def run(self):
+        from waveform_core import LoadCancelled, load_file_pyramid, stage_span
+
+        try:
+            with stage_span(self.timer, "pyramid_build"):
+                load_file_pyramid(self.filename_wav, self.cache, self.use_sidecar, self.isInterruptionRequested,
+                                  build=True, budget=self.budget)
+        except LoadCancelled:
+            return
+        except Exception:
+            # The view is then loaded without it, and reports the error
+            pass
+        super().run()
+
+
+class PyramidBuilder(QThread):
+    # Builds the whole-file pyramid in the background after the first view,
+    # so zooming out and panning never need to decode audio
+    def __init__(self, filename_wav, cache, budget=None, parent=None):
+        super().__init__(parent)
+        self.filename_wav = filename_wav
+        self.cache = cache
+        self.budget = budget
+
+    def run(self):
+        from waveform_core import LoadCancelled, load_file_pyramid
+
+        try:
+            load_file_pyramid(self.filename_wav, self.cache, should_stop=self.isInterruptionRequested, build=True,
+                              budget=self.budget)
+        except LoadCancelled:
+            pass
+        except Exception:
+            # Views keep working from decoded windows without it
+            pass
+
+
+class FollowWorker(QThread):
+    # Follows a WAV/RTTM pair that is still being written: reads what was
+    # appended every FOLLOW_INTERVAL_MS and emits the plot data of its last
+    # `window` seconds whenever the files grew, the window or width were
+    # changed from the GUI thread, or redraw() was called
+    loaded = pyqtSignal(object, object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, filename_wav, filename_rttm, window, pixel_width, timer=None, parent=None):
+        super().__init__(parent)
+        self.filename_wav = filename_wav
+        self.filename_rttm = filename_rttm
+        self.window = window
+        self.pixel_width = pixel_width
+        self.timer = timer
+        self.redraw_requested = False
+
+    def redraw(self):
+        self.redraw_requested = True
+
+    def run(self):
+        from waveform_core import LiveRecording, LoadCancelled
+
+        try:
+            recording = LiveRecording(self.filename_wav, self.filename_rttm)
+            shown = None
+            updates = 0
+            while not self.isInterruptionRequested():
+                # Spans are tagged with the update they may become
+                view = ("follow", updates + 1)
+                timer = self.timer.tagged(view=view) if self.timer is not None else None
+                changed = recording.update(self.isInterruptionRequested, timer)
+                request = (self.window, self.pixel_width)
+                if changed or request != shown or self.redraw_requested:
+                    self.redraw_requested = False
+                    data = recording.view(*request, timer)
+                    shown = request
+                    updates += 1
+                    self.loaded.emit(view, data)
+                self.msleep(FOLLOW_INTERVAL_MS)
+        except LoadCancelled:
+            pass
+        except Exception as e:
+            self.failed.emit(str(e))
+
 class MainWindow(QWidget):
-    def __init__(self):
+    def __init__(self, memory_budget_mib=None):
         super().__init__()
 
         self.filename_wav = None
         self.filename_rttm = None
+        self.filename_reference = None
+        self.lane_rttms = []
+        self.cache = None
+        self.preloader = None
+        self.loader = None
+        self.loaders = set()
+        self.loader_quiet = False
+        self.pyramid_builder = None
+        self.metrics_worker = None
+        self.metrics_dialog = None
+        self.export_worker = None
+        self.export_dialog = None
+        self.follow_worker = None
+        self.total_duration = None
+
+        # Session: jobs from session.load_session, their summaries and the
+        # recording shown. One recording ahead is prefetched at a time; the
+        # views it prepares are kept with the options they were loaded with.
+        self.session = []
+        self.session_summaries = {}
+        self.session_index = None
+        self.session_dialog = None
+        self.session_scanner = None
+        self.prefetcher = None
+        self.prefetch_queue = []
+        self.prefetched = {}
+        self.drag_start = None
+
+        # Timing spans of every view, tagged with the number of the view.
+        # Created with the cache once waveform_core is imported.
+        self.stage_timer = None
+        self.view_number = 0
+        self.shown_view = None
+
+        # One figure and canvas live for the whole session; views only update
+        # the data of their artists
+        self.figure = None
+        self.canvas = None
+        self.ax = None
+        self.label_lines = []
+        self.full_line = None
+        self.legend_colors = None
+        self.background = None
+        self.timings_text = None
+
+        # Stacked label lanes under the waveform when RTTM files are compared
+        self.lanes_ax = None
+        self.lane_artists = []
+
+        # Spectrogram panel between the waveform and the lanes. Its tiles are
+        # computed on a thread pool created when it is first shown.
+        self.spectrogram_ax = None
+        self.spectrogram_artists = []
+        self.spectrogram_pool = None
+
+        # Low-memory mode keeps the audio data held for a file within one
+        # budget, given in MiB on the command line or else the default one
+        self.memory_budget_mib = memory_budget_mib
 
         self.initUI()
 
@@ -376,6 +815,184 @@ class MainWindow(QWidget):
         self.warning_label.setGeometry(100, 360, 300, 30)
         self.warning_label.hide()
 
+        self.status_label = QLabel("", self)
+        self.status_label.setFont(QFont("Arial", 10))
+        self.status_label.setStyleSheet("color: black;")
+        self.status_label.setGeometry(100, 390, 400, 25)
+        self.status_label.hide()
+
+        # Sidecar files make reopening a file nearly instant, at the cost of
+        # a decoded copy of the audio on disk next to it
+        self.sidecar_checkbox = QCheckBox("Keep cache files on disk", self)
+        self.sidecar_checkbox.setFont(QFont("Arial", 10))
+        self.sidecar_checkbox.setStyleSheet("color: black;")
+        self.sidecar_checkbox.setGeometry(420, 310, 200, 30)
+
+        self.spectrogram_checkbox = QCheckBox("Show spectrogram", self)
+        self.spectrogram_checkbox.setFont(QFont("Arial", 10))
+        self.spectrogram_checkbox.setStyleSheet("color: black;")
+        self.spectrogram_checkbox.setGeometry(630, 310, 160, 30)
+        self.spectrogram_checkbox.toggled.connect(self.refresh_view)
+
+        # Audio stays in its stored form and long views are summarised while
+        # streaming it, so any recording can be opened within the budget
+        self.low_memory_checkbox = QCheckBox("Low-memory mode", self)
+        self.low_memory_checkbox.setFont(QFont("Arial", 10))
+        self.low_memory_checkbox.setStyleSheet("color: black;")
+        self.low_memory_checkbox.setGeometry(800, 310, 160, 30)
+        self.low_memory_checkbox.setChecked(self.memory_budget_mib is not None)
+        self.low_memory_checkbox.toggled.connect(self.set_low_memory)
+
+        # Draws the waveform into an image with NumPy instead of as
+        # matplotlib lines, which keeps long views fast to redraw
+        self.raster_checkbox = QCheckBox("Fast waveform drawing", self)
+        self.raster_checkbox.setFont(QFont("Arial", 10))
+        self.raster_checkbox.setStyleSheet("color: black;")
+        self.raster_checkbox.setGeometry(970, 310, 200, 30)
+        self.raster_checkbox.toggled.connect(self.set_raster_engine)
+
+        # Per-stage timings of the last view, drawn over the plot
+        self.timings_button = QPushButton("Timings", self)
+        self.timings_button.setFont(QFont("Arial", 9))
+        self.timings_button.setCheckable(True)
+        self.timings_button.setStyleSheet("""
+            QPushButton {
+                background-color: #99ccff; 
+                color: black; 
+                border: 2px solid #99ccff;
+                border-radius: 15px;
+            }
+            QPushButton:hover {
+                background-color: #80bfff;
+            }
+            QPushButton:checked, QPushButton:pressed {
+                background-color: #6699ff;
+            }
+        """)
+        self.timings_button.setGeometry(420, 350, 100, 30)
+        self.timings_button.toggled.connect(self.refresh_timings)
+
+        self.export_timings_button = QPushButton("Export Timings", self)
+        self.export_timings_button.setFont(QFont("Arial", 9))
+        self.export_timings_button.setStyleSheet("""
+            QPushButton {
+                background-color: #99ccff; 
+                color: black; 
+                border: 2px solid #99ccff;
+                border-radius: 15px;
+            }
+            QPushButton:hover {
+                background-color: #80bfff;
+            }
+            QPushButton:pressed {
+                background-color: #6699ff;
+            }
+        """)
+        self.export_timings_button.setGeometry(530, 350, 110, 30)
+        self.export_timings_button.clicked.connect(self.export_timings)
+
+        # Speaking time, overlap and DER/JER of the loaded RTTM
+        self.metrics_button = QPushButton("Metrics", self)
+        self.metrics_button.setFont(QFont("Arial", 9))
+        self.metrics_button.setStyleSheet("""
+            QPushButton {
+                background-color: #99ccff; 
+                color: black; 
+                border: 2px solid #99ccff;
+                border-radius: 15px;
+            }
+            QPushButton:hover {
+                background-color: #80bfff;
+            }
+            QPushButton:pressed {
+                background-color: #6699ff;
+            }
+        """)
+        self.metrics_button.setGeometry(650, 350, 100, 30)
+        self.metrics_button.clicked.connect(self.show_metrics)
+
+        # More RTTM files drawn as lanes under the waveform, with their errors
+        # against the reference RTTM (or else against the uploaded one)
+        self.add_lanes_button = QPushButton("Add RTTM Lanes", self)
+        self.add_lanes_button.setFont(QFont("Arial", 9))
+        self.add_lanes_button.setStyleSheet("""
+            QPushButton {
+                background-color: #99ccff; 
+                color: black; 
+                border: 2px solid #99ccff;
+                border-radius: 15px;
+            }
+            QPushButton:hover {
+                background-color: #80bfff;
+            }
+            QPushButton:pressed {
+                background-color: #6699ff;
+            }
+        """)
+        self.add_lanes_button.setGeometry(760, 350, 120, 30)
+        self.add_lanes_button.clicked.connect(self.add_lane_rttms)
+
+        # Audio of the RTTM turns written out as clips or per-label tracks
+        self.export_segments_button = QPushButton("Export Segments", self)
+        self.export_segments_button.setFont(QFont("Arial", 9))
+        self.export_segments_button.setStyleSheet("""
+            QPushButton {
+                background-color: #99ccff; 
+                color: black; 
+                border: 2px solid #99ccff;
+                border-radius: 15px;
+            }
+            QPushButton:hover {
+                background-color: #80bfff;
+            }
+            QPushButton:pressed {
+                background-color: #6699ff;
+            }
+        """)
+        self.export_segments_button.setGeometry(890, 350, 120, 30)
+        self.export_segments_button.clicked.connect(self.show_export)
+
+        # Keeps showing the end of files a running diarizer appends to
+        self.follow_button = QPushButton("Follow", self)
+        self.follow_button.setFont(QFont("Arial", 9))
+        self.follow_button.setCheckable(True)
+        self.follow_button.setStyleSheet("""
+            QPushButton {
+                background-color: #99ccff; 
+                color: black; 
+                border: 2px solid #99ccff;
+                border-radius: 15px;
+            }
+            QPushButton:hover {
+                background-color: #80bfff;
+            }
+            QPushButton:checked, QPushButton:pressed {
+                background-color: #6699ff;
+            }
+        """)
+        self.follow_button.setGeometry(1020, 350, 70, 30)
+        self.follow_button.toggled.connect(self.set_follow)
+
+        # A folder or manifest of recordings to step through
+        self.session_button = QPushButton("Open Session", self)
+        self.session_button.setFont(QFont("Arial", 9))
+        self.session_button.setStyleSheet("""
+            QPushButton {
+                background-color: #99ccff; 
+                color: black; 
+                border: 2px solid #99ccff;
+                border-radius: 15px;
+            }
+            QPushButton:hover {
+                background-color: #80bfff;
+            }
+            QPushButton:pressed {
+                background-color: #6699ff;
+            }
+        """)
+        self.session_button.setGeometry(420, 270, 120, 30)
+        self.session_button.clicked.connect(self.show_session)
+
         self.main_frame = QFrame(self)
         self.main_frame.setStyleSheet("background-color: #ededf3; border-radius: 15px;")
         self.main_frame.setGeometry(100, 450, 1080, 400)
@@ -400,7 +1017,72 @@ class MainWindow(QWidget):
         self.reset_button.clicked.connect(self.reset_ui)
         self.reset_button.hide()  # Initially hidden
 
+        # Zooming and panning re-render once the view has settled
+        self.view_timer = QTimer(self)
+        self.view_timer.setSingleShot(True)
+        self.view_timer.setInterval(VIEW_REFRESH_DELAY_MS)
+        self.view_timer.timeout.connect(self.refresh_view)
+
         self.show()
+        self.start_preloading()
+
+    def start_preloading(self):
+        self.status_label.setText("Loading audio and plotting libraries...")
+        self.status_label.show()
+        self.preloader = LibraryPreloader(self)
+        self.preloader.failed.connect(self.show_preload_error)
+        self.preloader.finished.connect(self.preloading_finished)
+        self.loaders.add(self.preloader)
+        self.preloader.start()
+
+    def preloading_finished(self):
+        self.loaders.discard(self.preloader)
+        self.preloader = None
+        if self.loader is None:
+            self.status_label.hide()
+        self.ensure_libraries()
+
+    def show_preload_error(self, message):
+        self.status_label.setText(f"Could not load libraries: {message}")
+
+    def ensure_libraries(self):
+        # Blocks only when a view is requested before the preloader is done
+        if self.cache is None:
+            from waveform_core import LRUCache, StageTimer
+            self.cache = LRUCache(self.cache_budget())
+            self.stage_timer = StageTimer()
+
+    def get_memory_budget(self):
+        if not self.low_memory_checkbox.isChecked():
+            return None
+        from waveform_core import LOW_MEMORY_BUDGET, MemoryBudget
+        return MemoryBudget(self.memory_budget_mib * 1024 * 1024 if self.memory_budget_mib else LOW_MEMORY_BUDGET)
+
+    def cache_budget(self):
+        from waveform_core import CACHE_BUDGET
+        budget = self.get_memory_budget()
+        return CACHE_BUDGET if budget is None else budget.cache_bytes
+
+    def set_low_memory(self):
+        # Pyramids already built for the other mode are dropped with the
+        # rest of the cache
+        self.cancel_pyramid_builder()
+        if self.cache is not None:
+            self.cache.clear()
+            self.cache.resize(self.cache_budget())
+        self.refresh_view()
+
+    def set_raster_engine(self):
+        # The next view is drawn from scratch with the chosen engine
+        if self.canvas is not None:
+            self.canvas.set_raster(None, None)
+        self.background = None
+        self.refresh_view()
+
+    def raster_size(self):
+        if not self.raster_checkbox.isChecked() or self.ax is None:
+            return None
+        return round(self.ax.bbox.width), round(self.ax.bbox.height), self.figure.dpi
 
     def resizeEvent(self, event):
         # Override resizeEvent to handle resizing of elements
@@ -456,12 +1138,13 @@ class MainWindow(QWidget):
             self.detect_languages(start_time, end_time)
 
     def detect_languages(self, start_time=None, end_time=None):
-        y, sr = librosa.load(self.filename_wav, sr=None)
+        self.follow_button.setChecked(False)
+        self.ensure_libraries()
+        from waveform_core import get_audio_duration
 
-        with open(self.filename_rttm, 'r') as file:
-            rttm_lines = file.readlines()
+        total_duration = get_audio_duration(self.filename_wav)
 
-        if start_time is not None and start_time > librosa.get_duration(y=y, sr=sr):
+        if start_time is not None and start_time > total_duration:
             warning_dialog = CustomWarningDialog("Entered start time exceeds the duration of the whole audio file.\nPlease enter a valid start time.")
             warning_dialog.exec_()
             return
@@ -471,32 +1154,716 @@ class MainWindow(QWidget):
             warning_dialog.exec_()
             return
 
-        if end_time is not None and end_time > librosa.get_duration(y=y, sr=sr):
+        if end_time is not None and end_time > total_duration:
             warning_dialog = CustomWarningDialog(f"Entered end time exceeds the duration of the whole audio file.\nWaveform will be plotted from {start_time} to the end of the audio file.")
             warning_dialog.exec_()
-            end_time = librosa.get_duration(y=y, sr=sr)
+            end_time = total_duration
+
+        self.total_duration = total_duration
+        self.load_view(start_time, end_time)
+
+    def load_view(self, start_time, end_time, quiet=False):
+        # Any view still being prepared is now useless
+        self.cancel_loading()
+
+        self.view_number += 1
+        pixel_width = self.ax.get_window_extent().width if self.ax is not None else self.main_frame.width()
+        self.loader = WaveformLoader(self.filename_wav, self.filename_rttm, self.cache,
+                                     start_time, end_time, pixel_width, self.sidecar_checkbox.isChecked(),
+                                     self.stage_timer.tagged(view=self.view_number), self.lane_filenames(),
+                                     self.get_spectrogram_pool(), self.get_memory_budget(), self.raster_size(), self)
+        self.loader_quiet = quiet
+        self.loader.progress.connect(self.show_progress)
+        self.loader.loaded.connect(self.show_waveform)
+        self.loader.failed.connect(self.show_load_error)
+        self.loader.finished.connect(self.loader_finished)
+        self.loaders.add(self.loader)
+        self.loader.start()
+
+    def get_spectrogram_pool(self):
+        if not self.spectrogram_checkbox.isChecked():
+            return None
+        if self.spectrogram_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.spectrogram_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+        return self.spectrogram_pool
+
+    def lane_filenames(self):
+        # The reference on top, then the uploaded RTTM and the added ones.
+        # A single RTTM has nothing to be compared with and gets no lanes.
+        filenames = [self.filename_reference] if self.filename_reference else []
+        filenames += [self.filename_rttm] + self.lane_rttms
+        return filenames if len(filenames) > 1 else []
+
+    def add_lane_rttms(self):
+        if not self.filename_rttm:
+            self.warning_label.show()
+            return
+        options = QFileDialog.Options()
+        filenames, _ = QFileDialog.getOpenFileNames(self, "Select RTTM files to compare", "", "RTTM files (*.rttm)", options=options)
+        if filenames:
+            self.lane_rttms += filenames
+            self.refresh_view()
+
+    def cancel_loading(self):
+        if self.loader is not None:
+            self.loader.requestInterruption()
+            self.loader = None
+        self.status_label.hide()
+
+    def loader_finished(self):
+        # Cancelled loaders are kept referenced until their thread exits
+        self.loaders.discard(self.sender())
+
+    def show_progress(self, message):
+        if self.sender() is not self.loader or self.loader_quiet:
+            return
+        self.status_label.setText(message)
+        self.status_label.show()
 
-        if start_time is not None and end_time is not None:
-            duration = end_time - start_time
-            y, sr, segments = split_audio_and_rttm(y, sr, rttm_lines, start_time, duration)
-        else:
-            segments = parse_rttm(self.filename_rttm, 0.0)
+    def show_load_error(self, message):
+        if self.sender() is not self.loader:
+            return
+        self.loader = None
+        self.status_label.hide()
+        warning_dialog = CustomWarningDialog(f"Could not display the waveform:\n{message}")
+        warning_dialog.exec_()
 
-        fig = plot_waveform(y, sr, segments, start_time)
+    def show_waveform(self, data):
+        if self.sender() is not self.loader:
+            return
+        self.shown_view = self.loader.timer.tags["view"]
+        self.loader = None
+        self.status_label.hide()
+        self.display_waveform(data)
+
+    def display_waveform(self, data):
+        self.update_waveform(data)
+        self.reset_button.show()  # Show reset button after plotting
+
+        if self.pyramid_builder is None or self.pyramid_builder.filename_wav != self.filename_wav:
+            self.cancel_pyramid_builder()
+            self.pyramid_builder = PyramidBuilder(self.filename_wav, self.cache, self.get_memory_budget(), self)
+            self.pyramid_builder.finished.connect(self.loader_finished)
+            self.loaders.add(self.pyramid_builder)
+            self.pyramid_builder.start()
+        # After the canvas has been laid out, which can change the width of
+        # the axes the next views are prepared for
+        QTimer.singleShot(0, self.schedule_prefetch)
+
+    def cancel_pyramid_builder(self):
+        if self.pyramid_builder is not None:
+            self.pyramid_builder.requestInterruption()
+            self.pyramid_builder = None
+
+    def create_canvas(self):
+        from matplotlib.figure import Figure
+        from waveform_canvas import TimedCanvas
+
+        self.figure = Figure(figsize=(14, 5))
+        self.canvas = TimedCanvas(self.figure)
+        self.ax = self.figure.subplots()
+        self.full_line, = self.ax.plot([], [], color='gray', alpha=0.2, label='Full Audio', animated=True)
+        self.timings_text = self.ax.text(0.01, 0.98, "", transform=self.ax.transAxes, va='top', ha='left',
+                                         family='monospace', fontsize=8, animated=True,
+                                         bbox=dict(facecolor='white', alpha=0.8, edgecolor='none'))
+        self.canvas.mpl_connect('draw_event', self.on_canvas_draw)
+        self.canvas.mpl_connect('scroll_event', self.on_scroll)
+        self.canvas.mpl_connect('button_press_event', self.on_press)
+        self.canvas.mpl_connect('motion_notify_event', self.on_motion)
+        self.canvas.mpl_connect('button_release_event', self.on_release)
+        self.canvas.mpl_connect('resize_event', self.on_canvas_resize)
 
         layout = self.main_frame.layout()
-        if layout is not None:
-            for i in reversed(range(layout.count())):
-                layout.itemAt(i).widget().setParent(None)
+        if layout is None:
+            layout = QVBoxLayout()
+            self.main_frame.setLayout(layout)
+        layout.addWidget(self.canvas)
+
+    def arrange_axes(self, spectrogram, lanes):
+        # The waveform on top, then the spectrogram and the lanes when they
+        # are shown, all sharing the time axis. Panels are rebuilt only when
+        # the set of shown panels changes.
+        if spectrogram == (self.spectrogram_ax is not None) and lanes == (self.lanes_ax is not None):
+            return
+        for panel in (self.spectrogram_ax, self.lanes_ax):
+            if panel is not None:
+                self.figure.delaxes(panel)
+        self.spectrogram_ax = None
+        self.spectrogram_artists = []
+        self.lanes_ax = None
+        self.lane_artists = []
+
+        ratios = [3] + ([2] if spectrogram else []) + ([1] if lanes else [])
+        grid = self.figure.add_gridspec(len(ratios), 1, height_ratios=ratios, hspace=0.08)
+        self.ax.set_subplotspec(grid[0])
+        row = 1
+        if spectrogram:
+            self.spectrogram_ax = self.figure.add_subplot(grid[row], sharex=self.ax)
+            row += 1
+        if lanes:
+            self.lanes_ax = self.figure.add_subplot(grid[row], sharex=self.ax)
+
+        # Only the bottom panel shows the time axis
+        panels = [self.ax, self.spectrogram_ax, self.lanes_ax]
+        panels = [panel for panel in panels if panel is not None]
+        for panel in panels[:-1]:
+            panel.tick_params(labelbottom=False)
+            panel.set_xlabel('')
+        panels[-1].tick_params(labelbottom=True)
+        panels[-1].set_xlabel('Time (seconds)')
+
+    def update_panels(self, data):
+        from waveform_core import draw_lanes, draw_spectrogram
+
+        spectrogram = data.get("spectrogram")
+        lanes = data.get("lanes")
+        self.arrange_axes(spectrogram is not None, bool(lanes))
+        for artist in self.spectrogram_artists + self.lane_artists:
+            artist.remove()
+        self.spectrogram_artists = []
+        self.lane_artists = []
+        if spectrogram is not None:
+            self.spectrogram_artists = draw_spectrogram(self.spectrogram_ax, spectrogram, self.legend_colors)
+        if lanes:
+            self.lane_artists = draw_lanes(self.lanes_ax, lanes, self.legend_colors)
+
+    def update_waveform(self, data):
+        from waveform_core import stage_span, style_waveform_axes
+
+        if self.canvas is None:
+            self.create_canvas()
+        self.canvas.timer = self.stage_timer.tagged(view=self.shown_view)
+
+        # Reuse the existing lines and only create or remove the difference
+        traces = data["traces"]
+        while len(self.label_lines) < len(traces):
+            line, = self.ax.plot([], [], alpha=0.8, animated=True)
+            self.label_lines.append(line)
+        for line in self.label_lines[len(traces):]:
+            line.remove()
+        del self.label_lines[len(traces):]
+
+        for line, (label, times, values) in zip(self.label_lines, traces):
+            line.set_data(times, values)
+            line.set_color(data["colors"][label])
+            line.set_label(f'{label}')
+        self.full_line.set_data(*data["full"])
+
+        # The lines are animated, so when limits and legend are unchanged only
+        # they are redrawn on top of the cached background
+        # The spectrogram and lanes are part of the background and change with
+        # every view
+        has_panels = (data.get("spectrogram") is not None or bool(data.get("lanes"))
+                      or self.spectrogram_ax is not None or self.lanes_ax is not None)
+        static_changed = (self.background is None
+                          or tuple(self.ax.get_xlim()) != tuple(data["xlim"])
+                          or tuple(self.ax.get_ylim()) != tuple(data["ylim"])
+                          or self.legend_colors != data["colors"]
+                          or has_panels)
+        if static_changed:
+            if self.legend_colors != data["colors"]:
+                style_waveform_axes(self.ax, data["colors"])
+                # Blitted with the lines so that it stays on top of them
+                self.ax.get_legend().set_animated(True)
+                self.legend_colors = data["colors"]
+            if has_panels:
+                self.update_panels(data)
+                if self.spectrogram_ax is not None or self.lanes_ax is not None:
+                    self.ax.set_xlabel('')
+            # After the panels, since an image resets the limits of shared axes
+            self.ax.set_xlim(*data["xlim"])
+            self.ax.set_ylim(*data["ylim"])
+            self.update_raster(data)
+            self.canvas.draw()
+        else:
+            self.update_raster(data)
+            with stage_span(self.canvas.timer, "blit"):
+                self.blit_waveform()
 
-        canvas = FigureCanvas(fig)
-        new_layout = QVBoxLayout()
-        new_layout.addWidget(canvas)
-        self.main_frame.setLayout(new_layout)
+        # Show the draw and paint of this view too once they are recorded
+        if self.timings_button.isChecked():
+            QTimer.singleShot(0, self.refresh_timings)
 
-        self.reset_button.show()  # Show reset button after plotting
+    def update_raster(self, data):
+        # Drawn again here when the axes changed size since the view was
+        # requested
+        from waveform_core import rasterize_waveform, stage_span
+
+        size = self.raster_size()
+        if size is None:
+            return
+        raster = data.get("raster")
+        if raster is None or raster.shape[:2] != (size[1], size[0]):
+            with stage_span(self.canvas.timer, "rasterize"):
+                raster = rasterize_waveform(data, *size)
+        self.canvas.set_raster(self.ax, raster, data["xlim"], data["ylim"])
+
+    def on_canvas_resize(self, event):
+        # The raster is stretched with the axes until the view is redrawn at
+        # their new size
+        raster = self.canvas.raster
+        if raster is not None and raster.shape[:2] != (round(self.ax.bbox.height), round(self.ax.bbox.width)):
+            self.view_timer.start()
+
+    def on_canvas_draw(self, event):
+        # A full draw leaves out the animated lines: remember the background
+        # they are blitted onto and put them back. The canvas repaints itself
+        # after a full draw, so no blit is needed here.
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.draw_animated()
+
+    def blit_waveform(self):
+        self.canvas.restore_region(self.background)
+        self.draw_animated()
+        self.canvas.blit(self.figure.bbox)
+
+    def draw_animated(self):
+        # With the raster engine the canvas paints the waveform itself, and
+        # the legend and timings drawn here are painted again on top of it
+        rasterized = self.canvas.raster is not None
+        if not rasterized:
+            for line in self.label_lines:
+                self.ax.draw_artist(line)
+            self.ax.draw_artist(self.full_line)
+        overlays = []
+        if self.ax.get_legend() is not None:
+            self.ax.draw_artist(self.ax.get_legend())
+            overlays.append(self.ax.get_legend().get_window_extent())
+        if self.timings_button.isChecked() and self.shown_view is not None:
+            self.timings_text.set_text(self.stage_timer.summary(view=self.shown_view))
+            self.ax.draw_artist(self.timings_text)
+            overlays.append(self.timings_text.get_bbox_patch().get_window_extent())
+        self.canvas.overlays = overlays if rasterized else []
+
+    def refresh_timings(self):
+        if self.canvas is not None and self.background is not None:
+            self.blit_waveform()
+
+    def export_timings(self):
+        filename, selected_filter = QFileDialog.getSaveFileName(
+            self, "Export Timings", "timings.json", "Chrome trace (*.json);;Timing spans (*.json)")
+        if filename:
+            self.ensure_libraries()
+            self.stage_timer.save(filename, chrome=selected_filter.startswith("Chrome"))
+
+    def show_metrics(self):
+        if not self.filename_rttm:
+            self.warning_label.show()
+            return
+        self.ensure_libraries()
+        if self.metrics_dialog is None:
+            self.metrics_dialog = MetricsDialog(self)
+            self.metrics_dialog.reference_button.clicked.connect(self.choose_reference_rttm)
+        self.metrics_dialog.set_text("Computing metrics...")
+        self.metrics_dialog.show()
+        self.metrics_dialog.raise_()
+
+        window = tuple(self.ax.get_xlim()) if self.ax is not None else None
+        self.metrics_worker = MetricsWorker(self.filename_rttm, self.filename_reference, self.cache, window, self)
+        self.metrics_worker.loaded.connect(self.show_metrics_text)
+        self.metrics_worker.failed.connect(self.show_metrics_error)
+        self.metrics_worker.finished.connect(self.loader_finished)
+        self.loaders.add(self.metrics_worker)
+        self.metrics_worker.start()
+
+    def choose_reference_rttm(self):
+        options = QFileDialog.Options()
+        filename, _ = QFileDialog.getOpenFileName(self, "Select reference RTTM file", "", "RTTM files (*.rttm)", options=options)
+        if filename:
+            self.filename_reference = filename
+            self.show_metrics()
+            self.refresh_view()
+
+    def show_metrics_text(self, text):
+        if self.sender() is self.metrics_worker and self.metrics_dialog is not None:
+            self.metrics_dialog.set_text(text)
+
+    def show_metrics_error(self, message):
+        if self.sender() is self.metrics_worker and self.metrics_dialog is not None:
+            self.metrics_dialog.set_text(f"Could not compute the metrics:\n{message}")
+
+    def show_export(self):
+        if not self.filename_wav or not self.filename_rttm:
+            self.warning_label.show()
+            return
+        self.ensure_libraries()
+        if self.export_dialog is None:
+            self.export_dialog = ExportDialog(self)
+            self.export_dialog.export_button.clicked.connect(self.start_export)
+            self.export_dialog.rejected.connect(self.cancel_export)
+        self.export_dialog.window_checkbox.setEnabled(self.ax is not None)
+        self.export_dialog.window_checkbox.setChecked(self.ax is not None)
+        self.export_dialog.set_status("")
+        self.export_dialog.show()
+        self.export_dialog.raise_()
+
+    def start_export(self):
+        output_dir = QFileDialog.getExistingDirectory(self, "Select a folder for the exported audio")
+        if not output_dir:
+            return
+        self.cancel_export()
+        dialog = self.export_dialog
+        window = tuple(self.ax.get_xlim()) if self.ax is not None and dialog.window_checkbox.isChecked() else None
+        self.export_worker = ExportWorker(self.filename_wav, self.filename_rttm, output_dir,
+                                          dialog.mode_combo.currentIndex() == 1, self.cache, window, self)
+        self.export_worker.progress.connect(self.show_export_text)
+        self.export_worker.loaded.connect(self.show_export_text)
+        self.export_worker.failed.connect(self.show_export_error)
+        self.export_worker.finished.connect(self.loader_finished)
+        self.loaders.add(self.export_worker)
+        dialog.set_status("Exporting...")
+        self.export_worker.start()
+
+    def cancel_export(self):
+        if self.export_worker is not None:
+            self.export_worker.requestInterruption()
+            self.export_worker = None
+
+    def show_export_text(self, text):
+        if self.sender() is self.export_worker and self.export_dialog is not None:
+            self.export_dialog.set_status(text)
+
+    def show_export_error(self, message):
+        if self.sender() is self.export_worker and self.export_dialog is not None:
+            self.export_dialog.set_status(f"Could not export the segments:\n{message}")
+
+    def on_scroll(self, event):
+        if event.inaxes is not self.ax or self.total_duration is None:
+            return
+        # Zoom around the time under the cursor
+        factor = ZOOM_STEP ** -event.step
+        x0, x1 = self.ax.get_xlim()
+        self.set_view(event.xdata - (event.xdata - x0) * factor, event.xdata + (x1 - event.xdata) * factor)
+
+    def on_press(self, event):
+        if event.button == 1 and event.inaxes is self.ax and self.total_duration is not None:
+            # Panning away from the end stops following
+            self.follow_button.setChecked(False)
+            self.drag_start = (event.x, self.ax.get_xlim())
+
+    def on_motion(self, event):
+        if self.drag_start is None:
+            return
+        x_pressed, (x0, x1) = self.drag_start
+        shift = (event.x - x_pressed) * (x1 - x0) / self.ax.bbox.width
+        self.set_view(x0 - shift, x1 - shift)
+
+    def on_release(self, event):
+        self.drag_start = None
+
+    def set_view(self, start_time, end_time):
+        # Clamp to the recording, move the axes right away and re-render the
+        # visible range at its level of detail once the view stops changing
+        span = min(max(end_time - start_time, MIN_VIEW_DURATION), self.total_duration)
+        if self.follow_worker is not None:
+            # Zooming keeps the end in view, drawn at the new span by the
+            # next update of the follow worker
+            start_time = self.total_duration - span
+            self.follow_worker.window = span
+        else:
+            start_time = min(max(start_time, 0.0), self.total_duration - span)
+        self.cancel_loading()
+        self.ax.set_xlim(start_time, start_time + span)
+        self.canvas.draw_idle()
+        if self.follow_worker is None:
+            self.view_timer.start()
+
+    def set_follow(self, checked):
+        if not checked:
+            if self.follow_worker is not None:
+                self.cancel_follow()
+                self.refresh_view()
+            return
+        if not self.filename_wav or not self.filename_rttm:
+            self.warning_label.show()
+            self.follow_button.setChecked(False)
+            return
+        self.ensure_libraries()
+        self.cancel_loading()
+        self.view_timer.stop()
+        if self.ax is not None:
+            x0, x1 = self.ax.get_xlim()
+            window, pixel_width = x1 - x0, self.ax.get_window_extent().width
+        else:
+            window, pixel_width = FOLLOW_WINDOW, self.main_frame.width()
+        self.follow_worker = FollowWorker(self.filename_wav, self.filename_rttm, window, pixel_width,
+                                          self.stage_timer, self)
+        self.follow_worker.loaded.connect(self.show_follow_view)
+        self.follow_worker.failed.connect(self.show_follow_error)
+        self.follow_worker.finished.connect(self.loader_finished)
+        self.loaders.add(self.follow_worker)
+        self.follow_worker.start()
+
+    def cancel_follow(self):
+        if self.follow_worker is not None:
+            self.follow_worker.requestInterruption()
+            self.follow_worker = None
+
+    def show_follow_view(self, view, data):
+        if self.sender() is not self.follow_worker:
+            return
+        self.total_duration = data["xlim"][1]
+        self.shown_view = view
+        self.update_waveform(data)
+        self.reset_button.show()
+
+    def show_follow_error(self, message):
+        if self.sender() is not self.follow_worker:
+            return
+        self.follow_worker = None
+        self.follow_button.setChecked(False)
+        warning_dialog = CustomWarningDialog(f"Could not follow the files:\n{message}")
+        warning_dialog.exec_()
+
+    def show_session(self):
+        self.ensure_libraries()
+        if self.session_dialog is None:
+            self.session_dialog = SessionDialog(self)
+            self.session_dialog.folder_button.clicked.connect(self.open_session_folder)
+            self.session_dialog.manifest_button.clicked.connect(self.open_session_manifest)
+            self.session_dialog.previous_button.clicked.connect(lambda: self.step_session(-1))
+            self.session_dialog.next_button.clicked.connect(lambda: self.step_session(1))
+            self.session_dialog.list_widget.currentRowChanged.connect(self.open_session_item)
+        self.session_dialog.show()
+        self.session_dialog.raise_()
+
+    def open_session_folder(self):
+        directory = QFileDialog.getExistingDirectory(self, "Select a folder of WAV and RTTM files")
+        if directory:
+            self.start_session(directory)
+
+    def open_session_manifest(self):
+        options = QFileDialog.Options()
+        filename, _ = QFileDialog.getOpenFileName(self, "Select a session manifest", "", "CSV files (*.csv);;All files (*)", options=options)
+        if filename:
+            self.start_session(filename)
+
+    def start_session(self, path):
+        from session import describe_recording, load_session
+
+        dialog = self.session_dialog
+        try:
+            jobs = load_session(path)
+        except Exception as e:
+            dialog.set_status(f"Could not open the session:\n{e}")
+            return
+        self.cancel_session()
+        self.session = jobs
+        dialog.list_widget.blockSignals(True)
+        dialog.list_widget.clear()
+        dialog.list_widget.addItems([describe_recording(job) for job in jobs])
+        dialog.list_widget.blockSignals(False)
+        if not jobs:
+            dialog.set_status(f"No WAV files with an RTTM file of the same name in {path}")
+            return
+
+        # Durations and counts fill in as they are read
+        self.session_scanner = SessionScanner(jobs, self.cache, self)
+        self.session_scanner.summarized.connect(self.show_session_summary)
+        self.session_scanner.finished.connect(self.loader_finished)
+        self.loaders.add(self.session_scanner)
+        self.session_scanner.start(QThread.LowPriority)
+        self.open_session_item(0)
+
+    def show_session_summary(self, index, summary):
+        if self.sender() is not self.session_scanner or self.session_dialog is None:
+            return
+        from session import describe_recording
+
+        self.session_summaries[index] = summary
+        self.session_dialog.list_widget.item(index).setText(describe_recording(self.session[index], summary))
+
+    def step_session(self, offset):
+        # Nothing is open before a session is, or after a reset
+        if self.session_index is not None:
+            self.open_session_item(self.session_index + offset)
+
+    def open_session_item(self, index):
+        if not 0 <= index < len(self.session):
+            return
+        self.follow_button.setChecked(False)
+        self.ensure_libraries()
+        from waveform_core import get_audio_duration
+
+        job = self.session[index]
+        self.session_index = index
+        self.filename_wav = job["wav"]
+        self.filename_rttm = job["rttm"]
+        self.filename_reference = None
+        self.lane_rttms = []
+        self.selected_audio_label.setText(f"Selected Audio File: {os.path.basename(self.filename_wav)}")
+        self.selected_audio_label.show()
+        self.selected_rttm_label.setText(f"Selected RTTM File: {os.path.basename(self.filename_rttm)}")
+        self.selected_rttm_label.show()
+        self.warning_label.hide()
+        if self.session_dialog is not None:
+            self.session_dialog.list_widget.blockSignals(True)
+            self.session_dialog.list_widget.setCurrentRow(index)
+            self.session_dialog.list_widget.blockSignals(False)
+            self.session_dialog.set_status(f"Recording {index + 1} of {len(self.session)}")
+
+        try:
+            total_duration = get_audio_duration(job["wav"])
+        except Exception as e:
+            warning_dialog = CustomWarningDialog(f"Could not open the recording:\n{e}")
+            warning_dialog.exec_()
+            return
+
+        # A prefetched view is only used when it was prepared with the options
+        # the view would be loaded with now. Windows running past the end of
+        # the file go through detect_languages, which warns about them.
+        prefetched = self.prefetched.pop(index, None)
+        options = self.prefetch_options()
+        fits = job["end"] is None or job["end"] <= total_duration
+        if fits and prefetched is not None and prefetched[0] == options and prefetched[1] is not None:
+            self.cancel_loading()
+            self.total_duration = total_duration
+            self.shown_view = prefetched[1]
+            self.display_waveform(prefetched[2])
+        elif fits and self.prefetcher is not None and self.prefetcher.session_index == index and self.prefetcher.options == options:
+            # Still being prepared: it becomes the loader of the view
+            self.cancel_loading()
+            self.total_duration = total_duration
+            self.loader, self.prefetcher = self.prefetcher, None
+            self.loader_quiet = False
+            self.loader.progress.connect(self.show_progress)
+            self.loader.loaded.connect(self.show_waveform)
+            self.loader.failed.connect(self.show_load_error)
+            self.loader.setPriority(QThread.NormalPriority)
+        else:
+            end_time = job["end"]
+            if job["start"] is not None and end_time is None:
+                end_time = total_duration
+            self.detect_languages(job["start"], end_time)
+
+    def prefetch_options(self):
+        # Everything a view depends on besides the recording and its window
+        pixel_width = self.ax.get_window_extent().width if self.ax is not None else self.main_frame.width()
+        budget = self.get_memory_budget()
+        return (pixel_width, self.raster_size(), budget.max_bytes if budget is not None else None,
+                self.sidecar_checkbox.isChecked(), self.spectrogram_checkbox.isChecked())
+
+    def schedule_prefetch(self):
+        # Called whenever a view is shown, so that prefetched views follow
+        # the current recording and the current options
+        if self.session_index is None or self.filename_wav != self.session[self.session_index]["wav"]:
+            return
+        options = self.prefetch_options()
+        wanted = range(self.session_index + 1, min(self.session_index + 1 + SESSION_PREFETCH_AHEAD, len(self.session)))
+        self.prefetched = {index: entry for index, entry in self.prefetched.items()
+                           if index in wanted and entry[0] == options}
+        if self.prefetcher is not None and (self.prefetcher.session_index not in wanted or self.prefetcher.options != options):
+            self.prefetcher.requestInterruption()
+            self.prefetcher = None
+        running = self.prefetcher.session_index if self.prefetcher is not None else None
+        self.prefetch_queue = [index for index in wanted if index not in self.prefetched and index != running]
+        self.start_prefetch()
+
+    def start_prefetch(self):
+        # One recording at a time, at low priority, so that the view being
+        # looked at keeps the processor
+        if self.prefetcher is not None or not self.prefetch_queue:
+            return
+        index = self.prefetch_queue.pop(0)
+        job = self.session[index]
+        options = self.prefetch_options()
+        self.view_number += 1
+        self.prefetcher = PrefetchLoader(index, options, job["wav"], job["rttm"], self.cache,
+                                         job["start"], job["end"], options[0], options[3],
+                                         self.stage_timer.tagged(view=self.view_number), (),
+                                         self.get_spectrogram_pool(), self.get_memory_budget(), options[1], self)
+        self.prefetcher.loaded.connect(self.store_prefetched)
+        self.prefetcher.failed.connect(self.store_prefetch_error)
+        self.prefetcher.finished.connect(self.loader_finished)
+        self.prefetcher.finished.connect(self.prefetch_finished)
+        self.loaders.add(self.prefetcher)
+        self.prefetcher.start(QThread.LowPriority)
+
+    def store_prefetched(self, data):
+        prefetcher = self.sender()
+        if prefetcher is self.prefetcher:
+            self.prefetched[prefetcher.session_index] = (prefetcher.options, prefetcher.timer.tags["view"], data)
+
+    def store_prefetch_error(self, message):
+        # Not retried: opening the recording loads it again and reports the error
+        prefetcher = self.sender()
+        if prefetcher is self.prefetcher:
+            self.prefetched[prefetcher.session_index] = (prefetcher.options, None, None)
+
+    def prefetch_finished(self):
+        if self.sender() is self.prefetcher:
+            self.prefetcher = None
+        self.start_prefetch()
+
+    def cancel_session(self):
+        if self.session_scanner is not None:
+            self.session_scanner.requestInterruption()
+            self.session_scanner = None
+        if self.prefetcher is not None:
+            self.prefetcher.requestInterruption()
+            self.prefetcher = None
+        self.prefetch_queue = []
+        self.prefetched = {}
+        self.session_summaries = {}
+        self.session_index = None
+
+    def refresh_view(self):
+        if self.follow_worker is not None:
+            # Drawn by the next update of the follow worker
+            if self.ax is not None:
+                self.follow_worker.pixel_width = self.ax.get_window_extent().width
+            self.follow_worker.redraw()
+            return
+        if self.ax is None or self.filename_wav is None or self.filename_rttm is None:
+            return
+        start_time, end_time = self.ax.get_xlim()
+        self.load_view(start_time, end_time, quiet=True)
+
+    def release_canvas(self):
+        # Drop every reference to the figure so its memory is actually freed
+        if self.canvas is None:
+            return
+        self.figure.clear()
+        self.canvas.setParent(None)
+        self.canvas.deleteLater()
+        self.figure = None
+        self.canvas = None
+        self.ax = None
+        self.label_lines = []
+        self.full_line = None
+        self.legend_colors = None
+        self.background = None
+        self.timings_text = None
+        self.lanes_ax = None
+        self.lane_artists = []
+        self.spectrogram_ax = None
+        self.spectrogram_artists = []
+
+    def closeEvent(self, event):
+        # Let background threads stop before their objects are destroyed
+        self.cancel_loading()
+        self.cancel_pyramid_builder()
+        self.cancel_export()
+        self.cancel_follow()
+        self.cancel_session()
+        for thread in list(self.loaders):
+            thread.wait()
+        if self.spectrogram_pool is not None:
+            self.spectrogram_pool.shutdown(wait=False)
+            self.spectrogram_pool = None
+        super().closeEvent(event)
 
     def reset_ui(self):
+        self.cancel_follow()
+        self.follow_button.setChecked(False)
+        self.cancel_loading()
+        self.cancel_pyramid_builder()
+        self.view_timer.stop()
+        self.total_duration = None
+        self.drag_start = None
+        self.release_canvas()
+
     # Delete the main frame and recreate it
         self.main_frame.deleteLater()  # Remove the existing main frame
         self.main_frame = QFrame(self)  # Recreate the main frame
@@ -518,12 +1885,56 @@ class MainWindow(QWidget):
     # Reset filenames
         self.filename_wav = None
         self.filename_rttm = None
+        self.filename_reference = None
+        self.lane_rttms = []
+        self.metrics_worker = None
+        if self.metrics_dialog is not None:
+            self.metrics_dialog.hide()
+        self.cancel_export()
+        if self.export_dialog is not None:
+            self.export_dialog.hide()
+        self.cancel_session()
+        self.session = []
+        if self.session_dialog is not None:
+            self.session_dialog.list_widget.blockSignals(True)
+            self.session_dialog.list_widget.clear()
+            self.session_dialog.list_widget.blockSignals(False)
+            self.session_dialog.hide()
 
     # Hide warning label if visible
         self.warning_label.hide()
 
 
+def report_startup(main_window, quit_after=False):
+    # Prints how long the window took to appear and the libraries to load,
+    # counted from the start of this module
+    def shown():
+        print(f"Window shown after {(time.perf_counter() - STARTED) * 1000:.0f} ms")
+
+    def loaded():
+        print(f"Libraries loaded after {(time.perf_counter() - STARTED) * 1000:.0f} ms")
+        if quit_after:
+            main_window.close()
+
+    QTimer.singleShot(0, shown)
+    main_window.preloader.finished.connect(loaded)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Visualize audio waveforms with their RTTM diarization segments.")
+    parser.add_argument('--startup-time', action='store_true',
+                        help="print how long the window and the libraries took to load, then exit")
+    parser.add_argument('--memory-budget', type=int, metavar='MIB',
+                        help="start in low-memory mode, keeping the audio data held for a file within this many MiB")
+    # Qt handles its own options
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+
 if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
     app = QApplication(sys.argv)
-    main_window = MainWindow()
+    main_window = MainWindow(args.memory_budget)
+    if args.startup_time:
+        report_startup(main_window, quit_after=True)
     sys.exit(app.exec_())
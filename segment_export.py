@@ -0,0 +1,184 @@
+import csv
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import soundfile as sf
+
+from diarization_metrics import label_intervals
+from waveform_core import AUDIO_READ_BLOCK, NATIVE_DTYPES, LoadCancelled, open_pcm_memmap, wav_data_layout
+
+# Audio of the RTTM turns written out as WAV files: one clip per turn, or one
+# track per label with all of its speech concatenated. Files are written in
+# the stored sample format of the source, on a thread pool.
+#
+# From a plain PCM or float WAV, the samples are memory-mapped and every
+# file is the source's own "fmt " chunk followed by slices of the map, written
+# straight from the page cache. Other files are read by offset through one
+# soundfile handle per thread. Both release the GIL while reading and
+# writing, so the export is bound by the disk rather than by Python.
+
+# Name of the CSV listing every exported interval, written in the output folder
+EXPORT_INDEX = "segments.csv"
+# Largest RIFF size a WAV header can hold. Longer files are written as RF64,
+# which libsndfile and most audio tools read like WAV.
+RIFF_MAX_SIZE = 0xFFFFFFFF
+
+def _safe_name(label):
+    name = re.sub(r'[^\w.-]+', '_', label).strip('.')
+    return name or "label"
+
+def _unique_names(labels):
+    # File and folder name of every label. Labels that sanitize to the same
+    # name, e.g. "spk 1" and "spk_1", or that differ only in case, which
+    # case-insensitive file systems do not tell apart, get a number appended.
+    names = []
+    used = set()
+    for code, label in enumerate(labels):
+        name = candidate = _safe_name(label)
+        suffix = code
+        while candidate.casefold() in used:
+            candidate = f"{name}_{suffix}"
+            suffix += 1
+        used.add(candidate.casefold())
+        names.append(candidate)
+    return names
+
+def export_plan(rttm_index, per_label=False, start_time=None, end_time=None):
+    # (relative path, label, [(start, end), ...]) for every file to write,
+    # with times in seconds. Clips are the turns clipped to the window; tracks
+    # concatenate each label's turns merged into disjoint intervals, so that
+    # overlapping turns do not repeat audio.
+    names = _unique_names(rttm_index.labels)
+    if per_label:
+        starts, ends, codes = label_intervals(rttm_index, start_time, end_time)
+        plan = []
+        for code, label in enumerate(rttm_index.labels):
+            mine = codes == code
+            if mine.any():
+                plan.append((f"{names[code]}.wav", label, list(zip(starts[mine].tolist(), ends[mine].tolist()))))
+        return plan
+
+    low = -np.inf if start_time is None else start_time
+    high = np.inf if end_time is None else end_time
+    indices = rttm_index.query(low, high)
+    starts = np.maximum(rttm_index.starts[indices], low)
+    ends = np.minimum(rttm_index.starts[indices] + rttm_index.durations[indices], high)
+    plan = []
+    counts = [0] * len(names)
+    for start, end, code in zip(starts.tolist(), ends.tolist(), rttm_index.codes[indices].tolist()):
+        if end <= start:
+            continue
+        path = os.path.join(names[code], f"{names[code]}_{counts[code]:05d}_{start:.3f}-{end:.3f}.wav")
+        counts[code] += 1
+        plan.append((path, rttm_index.labels[code], [(start, end)]))
+    return plan
+
+class _Source:
+    # Reads frame ranges of the source file from any worker thread: slices of
+    # a shared memory map, or one soundfile handle per thread
+    def __init__(self, filename):
+        self.filename = filename
+        info = sf.info(filename)
+        self.samplerate = info.samplerate
+        self.channels = info.channels
+        self.frames = info.frames
+        layout = wav_data_layout(filename)
+        self.pcm = open_pcm_memmap(filename, layout)
+        self.fmt = None if self.pcm is None else layout["fmt"]
+        # Formats without a native dtype are read as float32 and written as
+        # 32-bit float
+        self.dtype = NATIVE_DTYPES.get(info.subtype, ("float32", 1.0))[0]
+        self.subtype = info.subtype if info.subtype in NATIVE_DTYPES else "FLOAT"
+        self.local = threading.local()
+        self.handles = []
+        self.lock = threading.Lock()
+
+    def frame_range(self, start_time, end_time):
+        start_frame = min(max(int(round(start_time * self.samplerate)), 0), self.frames)
+        end_frame = min(max(int(round(end_time * self.samplerate)), start_frame), self.frames)
+        return start_frame, end_frame
+
+    def blocks(self, start_frame, end_frame):
+        audio_file = getattr(self.local, "audio_file", None)
+        if audio_file is None:
+            audio_file = self.local.audio_file = sf.SoundFile(self.filename)
+            with self.lock:
+                self.handles.append(audio_file)
+        audio_file.seek(start_frame)
+        for offset in range(start_frame, end_frame, AUDIO_READ_BLOCK):
+            yield audio_file.read(min(AUDIO_READ_BLOCK, end_frame - offset), dtype=self.dtype, always_2d=True)
+
+    def close(self):
+        for audio_file in self.handles:
+            audio_file.close()
+
+def _riff_size(fmt, data_bytes):
+    # "WAVE", the "fmt " chunk padded to an even size and the "data" chunk
+    return 4 + 8 + len(fmt) + len(fmt) % 2 + 8 + data_bytes
+
+def _wav_header(fmt, data_bytes):
+    fmt_chunk = b'fmt ' + len(fmt).to_bytes(4, 'little') + fmt + b'\0' * (len(fmt) % 2)
+    riff_size = _riff_size(fmt, data_bytes)
+    return b'RIFF' + riff_size.to_bytes(4, 'little') + b'WAVE' + fmt_chunk + b'data' + data_bytes.to_bytes(4, 'little')
+
+def _write_file(source, output, ranges, should_stop):
+    if should_stop is not None and should_stop():
+        raise LoadCancelled()
+    frame_ranges = [source.frame_range(start_time, end_time) for start_time, end_time in ranges]
+    frames = sum(end_frame - start_frame for start_frame, end_frame in frame_ranges)
+
+    if source.pcm is not None and _riff_size(source.fmt, frames * source.pcm.itemsize * source.channels) <= RIFF_MAX_SIZE:
+        with open(output, 'wb') as file:
+            file.write(_wav_header(source.fmt, frames * source.pcm.itemsize * source.channels))
+            for start_frame, end_frame in frame_ranges:
+                file.write(source.pcm[start_frame:end_frame])
+        return frames
+
+    # Counted with samples as wide as the dtype they are read as and the
+    # largest "fmt " chunk libsndfile writes (WAVE_FORMAT_EXTENSIBLE, 40
+    # bytes), so that a file only just too long is never written as WAV
+    data_bytes = frames * np.dtype(source.dtype).itemsize * source.channels
+    container = 'WAV' if _riff_size(b'\0' * 40, data_bytes) <= RIFF_MAX_SIZE else 'RF64'
+    with sf.SoundFile(output, 'w', source.samplerate, source.channels, source.subtype, format=container) as out_file:
+        for start_frame, end_frame in frame_ranges:
+            for block in source.blocks(start_frame, end_frame):
+                out_file.write(block)
+    return frames
+
+def export_segments(filename_wav, rttm_index, output_dir, per_label=False, start_time=None, end_time=None,
+                    workers=None, should_stop=None, progress=None):
+    # Writes the files of export_plan under output_dir together with the
+    # EXPORT_INDEX listing. progress(done, total) is called as files complete,
+    # and should_stop is polled before each file is started.
+    plan = export_plan(rttm_index, per_label, start_time, end_time)
+    source = _Source(filename_wav)
+    for folder in {os.path.dirname(path) for path, _, _ in plan} | {""}:
+        os.makedirs(os.path.join(output_dir, folder), exist_ok=True)
+    frames = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_write_file, source, os.path.join(output_dir, path), ranges, should_stop)
+                       for path, _, ranges in plan]
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    frames += future.result()
+                    if progress is not None:
+                        progress(done, len(plan))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        source.close()
+
+    with open(os.path.join(output_dir, EXPORT_INDEX), 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["file", "label", "start", "end"])
+        for path, label, ranges in plan:
+            for start, end in ranges:
+                writer.writerow([path.replace(os.sep, '/'), label, f"{start:.3f}", f"{end:.3f}"])
+
+    return {"files": len(plan), "frames": frames, "seconds": frames / source.samplerate, "output": output_dir}
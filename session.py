@@ -0,0 +1,82 @@
+import csv
+import os
+
+import soundfile as sf
+
+from waveform_core import load_rttm_index
+
+# Sessions: lists of WAV/RTTM pairs reviewed one after the other, read from a
+# manifest or found in a folder. Every pair is a job dict with the "wav" and
+# "rttm" paths and an optional "start"/"end" window in seconds.
+
+def read_manifest(filename):
+    # One "wav,rttm[,start,end]" row per job. Relative paths are resolved
+    # against the manifest's directory; blank lines, lines starting with '#'
+    # and a "wav,rttm,..." header row are skipped.
+    base_dir = os.path.dirname(os.path.abspath(filename))
+    jobs = []
+    with open(filename, 'r', newline='') as file:
+        for row in csv.reader(file):
+            row = [field.strip() for field in row]
+            if not row or not row[0] or row[0].startswith('#') or row[0].lower() == 'wav':
+                continue
+            if len(row) < 2:
+                raise ValueError(f"{filename}: expected at least 'wav,rttm' in row {row}")
+            start_time = float(row[2]) if len(row) > 2 and row[2] else None
+            end_time = float(row[3]) if len(row) > 3 and row[3] else None
+            jobs.append({
+                "wav": os.path.join(base_dir, row[0]),
+                "rttm": os.path.join(base_dir, row[1]),
+                "start": start_time,
+                "end": end_time,
+            })
+    return jobs
+
+def find_pairs(directory):
+    # Every WAV file under directory with an RTTM file of the same name next
+    # to it, in path order. WAV files without one are left out.
+    jobs = []
+    for folder, subfolders, filenames in os.walk(directory):
+        subfolders.sort()
+        rttms = {os.path.splitext(name)[0]: name for name in filenames if name.lower().endswith('.rttm')}
+        for name in sorted(filenames):
+            stem, extension = os.path.splitext(name)
+            if extension.lower() == '.wav' and stem in rttms:
+                jobs.append({
+                    "wav": os.path.join(folder, name),
+                    "rttm": os.path.join(folder, rttms[stem]),
+                    "start": None,
+                    "end": None,
+                })
+    return jobs
+
+def load_session(path):
+    return find_pairs(path) if os.path.isdir(path) else read_manifest(path)
+
+def recording_summary(job, cache=None):
+    # Duration from the WAV header and label and turn counts from the RTTM
+    # index, which is read from its segment store when there is one
+    info = sf.info(job["wav"])
+    rttm_index = load_rttm_index(job["rttm"], cache)
+    return {
+        "duration": info.frames / info.samplerate,
+        "samplerate": info.samplerate,
+        "channels": info.channels,
+        "speakers": len(rttm_index.labels),
+        "turns": len(rttm_index),
+    }
+
+def describe_recording(job, summary=None):
+    # One line of the session list: file name, then the summary once known
+    name = os.path.basename(job["wav"])
+    if job["start"] is not None or job["end"] is not None:
+        end = f"{job['end']:g}" if job["end"] is not None else "end"
+        name += f" [{job['start'] or 0:g}-{end}]"
+    if summary is None:
+        return f"{name}    ..."
+    if "error" in summary:
+        return f"{name}    error: {summary['error']}"
+    minutes, seconds = divmod(int(round(summary["duration"])), 60)
+    hours, minutes = divmod(minutes, 60)
+    return (f"{name}    {hours}:{minutes:02d}:{seconds:02d}    "
+            f"{summary['speakers']} speakers    {summary['turns']} turns")
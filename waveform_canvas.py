@@ -0,0 +1,76 @@
+import math
+
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.transforms import Bbox
+from PyQt5.QtCore import QPointF, QRectF
+from PyQt5.QtGui import QImage, QPainter
+
+from waveform_core import stage_span
+
+
+class TimedCanvas(FigureCanvas):
+    # Adds the Agg draw and the Qt paint of the canvas to a StageTimer.
+    #
+    # With a raster set, the image from rasterize_waveform is painted over
+    # its axes after the Agg buffer, followed by the overlay regions of the
+    # buffer (legend, timings) so that they stay on top of the waveform.
+    def __init__(self, figure, timer=None):
+        super().__init__(figure)
+        self.timer = timer
+        self.raster = None
+        self.raster_image = None
+        self.raster_ax = None
+        self.raster_limits = None
+        # Bboxes in display coordinates
+        self.overlays = []
+
+    def draw(self):
+        with stage_span(self.timer, "draw"):
+            super().draw()
+
+    def set_raster(self, ax, raster, xlim=None, ylim=None):
+        # The QImage shares the memory of the array, which is kept here for
+        # as long as the image is painted
+        self.raster = raster
+        self.raster_ax = ax
+        self.raster_limits = (xlim, ylim)
+        self.raster_image = None
+        if raster is not None:
+            self.raster_image = QImage(raster.data, raster.shape[1], raster.shape[0], raster.strides[0],
+                                       QImage.Format_RGBA8888_Premultiplied)
+        self.update()
+
+    def widget_rect(self, bbox):
+        # Display coordinates, in device pixels from the bottom left, to
+        # widget coordinates
+        ratio = self.device_pixel_ratio
+        return QRectF(bbox.x0 / ratio, (self.figure.bbox.height - bbox.y1) / ratio, bbox.width / ratio, bbox.height / ratio)
+
+    def paintEvent(self, event):
+        with stage_span(self.timer, "qt_paint"):
+            super().paintEvent(event)
+            if self.raster_image is not None and hasattr(self, 'renderer'):
+                self.paint_raster()
+
+    def paint_raster(self):
+        painter = QPainter(self)
+        try:
+            painter.setClipRect(self.widget_rect(self.raster_ax.bbox))
+            # Stretched to the current limits of the axes while panning and
+            # zooming, until the view is rasterized again
+            (x0, x1), (y0, y1) = self.raster_limits
+            painter.drawImage(self.widget_rect(Bbox(self.raster_ax.transData.transform([(x0, y0), (x1, y1)]))),
+                              self.raster_image)
+
+            for bbox in self.overlays:
+                bbox = Bbox.intersection(Bbox.from_extents(math.floor(bbox.x0), math.floor(bbox.y0),
+                                                           math.ceil(bbox.x1), math.ceil(bbox.y1)), self.figure.bbox)
+                if bbox is None:
+                    continue
+                buf = memoryview(self.copy_from_bbox(bbox))
+                image = QImage(buf, buf.shape[1], buf.shape[0], QImage.Format_RGBA8888)
+                image.setDevicePixelRatio(self.device_pixel_ratio)
+                rect = self.widget_rect(bbox)
+                painter.drawImage(QPointF(rect.left(), rect.top()), image)
+        finally:
+            painter.end()
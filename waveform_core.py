@@ -0,0 +1,1565 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import wait
+from contextlib import contextmanager, nullcontext
+import numpy as np
+import soundfile as sf
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.patches import Patch
+
+# Parsing, decoding and plotting helpers shared by the GUI in main.py and the
+# headless tools. Nothing here imports Qt or pyplot.
+
+class RTTMIndex:
+    # Columnar view of an RTTM file: segments sorted by start time with the
+    # running maximum of their end times. Since max_ends never decreases, both
+    # bounds of a window query are found with searchsorted.
+    def __init__(self, starts, durations, codes, labels):
+        order = np.argsort(starts, kind='stable')
+        self.starts = np.ascontiguousarray(np.asarray(starts, dtype=np.float64)[order])
+        self.durations = np.ascontiguousarray(np.asarray(durations, dtype=np.float64)[order])
+        self.codes = np.ascontiguousarray(np.asarray(codes, dtype=np.int32)[order])
+        self.labels = list(labels)
+        self.max_ends = np.maximum.accumulate(self.starts + self.durations) if len(self.starts) else np.empty(0)
+
+    @classmethod
+    def from_sorted(cls, starts, durations, codes, labels, max_ends):
+        # Columns already in index order, e.g. memory-mapped from a segment
+        # store, are used as they are instead of being sorted and copied
+        rttm_index = cls.__new__(cls)
+        rttm_index.starts = starts
+        rttm_index.durations = durations
+        rttm_index.codes = codes
+        rttm_index.labels = list(labels)
+        rttm_index.max_ends = max_ends
+        return rttm_index
+
+    @classmethod
+    def from_lines(cls, lines, offset=0.0):
+        label_codes = {}
+        starts, durations, codes = _parse_rttm_lines(lines, label_codes)
+        return cls(starts + offset, durations, codes, label_codes)
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.durations.nbytes + self.codes.nbytes + self.max_ends.nbytes
+
+    @property
+    def ends(self):
+        return self.starts + self.durations
+
+    def query(self, start_time, end_time):
+        # Indices of the segments overlapping [start_time, end_time)
+        lo = np.searchsorted(self.max_ends, start_time, side='right')
+        hi = np.searchsorted(self.starts, end_time, side='left')
+        if hi <= lo:
+            return np.empty(0, dtype=np.intp)
+        candidates = np.arange(lo, hi)
+        return candidates[self.starts[lo:hi] + self.durations[lo:hi] > start_time]
+
+    def segments(self, start_time=None, end_time=None):
+        # (starts, ends, codes, labels) of the segments clipped to the window,
+        # with times relative to its start; codes index labels
+        if start_time is None:
+            start_time = 0.0
+        if end_time is None:
+            end_time = np.inf
+        indices = self.query(start_time, end_time)
+        starts = np.maximum(self.starts[indices], start_time)
+        ends = np.minimum(self.starts[indices] + self.durations[indices], end_time)
+        return starts - start_time, ends - start_time, self.codes[indices], self.labels
+
+def _parse_rttm_lines(lines, label_codes):
+    # Start, duration and label code columns of the SPEAKER lines; labels not
+    # in label_codes yet are added to it with the next free code. Other
+    # record types (SPKR-INFO, LEXEME, NOSCORE, ...) are not turns.
+    starts = []
+    durations = []
+    codes = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) < 8 or parts[0] != "SPEAKER":
+            continue
+        starts.append(parts[3])
+        durations.append(parts[4])
+        codes.append(label_codes.setdefault(parts[7], len(label_codes)))
+    return np.array(starts, dtype=np.float64), np.array(durations, dtype=np.float64), np.array(codes, dtype=np.int32)
+
+def parse_rttm(filename, segment_start_time=0.0):
+    with open(filename, 'r') as file:
+        return RTTMIndex.from_lines(file, segment_start_time)
+    
+def adjust_alpha(color, alpha_factor=0.8):
+    r, g, b, a = color
+    a = max(a * alpha_factor, 0.0)
+    return (r, g, b, a)
+
+# Waveform pyramid: level 0 summarises PYRAMID_BASE_BLOCK samples per bin, and
+# every following level merges PYRAMID_FACTOR bins of the previous one.
+PYRAMID_BASE_BLOCK = 64
+PYRAMID_FACTOR = 4
+# Samples summarised at a time while building level 0, a multiple of the block
+PYRAMID_CHUNK = PYRAMID_BASE_BLOCK << 14
+# Whole-file pyramids start coarser: windows that need finer bins are short
+# enough to be decoded directly, and this keeps long files' pyramids small
+FILE_PYRAMID_BASE_BLOCK = 256
+# Windows with up to this many samples per pixel column are drawn sample by
+# sample; finer than the pyramid but denser than this, each column is drawn
+# as the min and max of its samples
+RAW_SAMPLES_PER_PIXEL = 2
+
+def _reduce_bins(values, block, ufunc):
+    return ufunc.reduceat(values, np.arange(0, len(values), block))
+
+def build_waveform_pyramid(y, base_block=PYRAMID_BASE_BLOCK, factor=PYRAMID_FACTOR):
+    # Level 0 is built chunk by chunk so y can be a memory map of any length
+    # without ever being copied whole
+    chunk = max(PYRAMID_CHUNK // base_block, 1) * base_block
+    chunks = (y[offset:offset + chunk] for offset in range(0, len(y), chunk))
+    return build_pyramid_from_chunks(chunks, len(y), base_block, factor)
+
+def build_pyramid_from_chunks(chunks, n_samples, base_block=PYRAMID_BASE_BLOCK, factor=PYRAMID_FACTOR, scale=1.0):
+    # chunks are consecutive pieces of the signal; all but the last must hold
+    # a multiple of base_block samples. Integer PCM chunks are reduced as they
+    # are, and only the bins are multiplied by scale.
+    levels = []
+    if n_samples == 0:
+        return {"n_samples": 0, "levels": levels}
+
+    n_bins = -(-n_samples // base_block)
+    mins = np.empty(n_bins, dtype=np.float32)
+    maxs = np.empty(n_bins, dtype=np.float32)
+    sumsq = np.empty(n_bins, dtype=np.float64)
+    first_bin = 0
+    for block in chunks:
+        block = np.asarray(block)
+        last_bin = first_bin + -(-len(block) // base_block)
+        mins[first_bin:last_bin] = _reduce_bins(block, base_block, np.minimum) * scale
+        maxs[first_bin:last_bin] = _reduce_bins(block, base_block, np.maximum) * scale
+        sumsq[first_bin:last_bin] = _reduce_bins(np.square(block, dtype=np.float64), base_block, np.add) * scale ** 2
+        first_bin = last_bin
+
+    counts = np.diff(np.append(np.arange(0, n_samples, base_block), n_samples))
+    level = {
+        "block": base_block,
+        "min": mins,
+        "max": maxs,
+        "rms": np.sqrt(sumsq / counts).astype(np.float32),
+    }
+    levels.append(level)
+
+    # Keep merging until a level is small enough to be drawn as-is
+    while len(level["min"]) > factor:
+        sumsq = _reduce_bins(np.square(level["rms"], dtype=np.float64) * counts, factor, np.add)
+        counts = _reduce_bins(counts, factor, np.add)
+        level = {
+            "block": level["block"] * factor,
+            "min": _reduce_bins(level["min"], factor, np.minimum),
+            "max": _reduce_bins(level["max"], factor, np.maximum),
+            "rms": np.sqrt(sumsq / counts).astype(np.float32),
+        }
+        levels.append(level)
+
+    return {"n_samples": n_samples, "levels": levels}
+
+def pyramid_nbytes(pyramid):
+    return sum(level[key].nbytes for level in pyramid["levels"] for key in ("min", "max", "rms"))
+
+def trim_pyramid(pyramid, max_bytes):
+    # Drops the finest levels until the pyramid fits in max_bytes. What is
+    # left is the pyramid of a coarser base block, e.g. a sidecar written
+    # without a memory budget loaded with one.
+    levels = pyramid["levels"]
+    nbytes = pyramid_nbytes(pyramid)
+    first = 0
+    while first < len(levels) - 1 and nbytes > max_bytes:
+        nbytes -= sum(levels[first][key].nbytes for key in ("min", "max", "rms"))
+        first += 1
+    return pyramid if first == 0 else {"n_samples": pyramid["n_samples"], "levels": levels[first:]}
+
+def select_pyramid_level(pyramid, n_samples, pixel_width):
+    # Pick the coarsest level that still gives at least one bin per pixel;
+    # None means the window is too short for any level and is drawn from the
+    # samples themselves.
+    samples_per_pixel = n_samples / max(int(pixel_width), 1)
+    selected = None
+    for level in pyramid["levels"]:
+        if level["block"] <= samples_per_pixel:
+            selected = level
+    return selected
+
+def waveform_envelope(y, level, start_sample, end_sample, max_columns=None):
+    # Returns sample positions and values for [start_sample, end_sample). At a
+    # decimated level every bin contributes its min and its max, so the line
+    # sweeps the full envelope of the samples it stands for. With max_columns
+    # the bins are merged further, down to about one per pixel column.
+    if level is None:
+        samples = np.asarray(y[start_sample:end_sample])
+        if max_columns is None or len(samples) <= RAW_SAMPLES_PER_PIXEL * max(int(max_columns), 1):
+            return np.arange(start_sample, end_sample), samples
+        # Bins of the samples themselves, one per pixel column
+        block = -(-len(samples) // int(max_columns))
+        mins = _reduce_bins(samples, block, np.minimum)
+        maxs = _reduce_bins(samples, block, np.maximum)
+        starts = start_sample + np.arange(len(mins)) * block
+        widths = np.minimum(block, end_sample - starts)
+    else:
+        block = level["block"]
+        first_bin = start_sample // block
+        last_bin = min(-(-end_sample // block), len(level["min"]))
+        mins = level["min"][first_bin:last_bin]
+        maxs = level["max"][first_bin:last_bin]
+        starts = np.arange(first_bin, last_bin) * block
+        widths = np.full(len(starts), block)
+
+    if max_columns is not None and len(mins) > max_columns:
+        group = -(-len(mins) // int(max_columns))
+        mins = _reduce_bins(mins, group, np.minimum)
+        maxs = _reduce_bins(maxs, group, np.maximum)
+        widths = _reduce_bins(widths, group, np.add)
+        starts = starts[::group]
+
+    positions = np.repeat(starts + widths / 2, 2)
+    values = np.empty(len(positions), dtype=np.float32)
+    values[0::2] = mins
+    values[1::2] = maxs
+    return positions, values
+
+def waveform_plot_data(y, sr, segments, start_time, pyramid=None, sample_offset=0, pixel_width=1400, n_samples=None):
+    # Everything needed to draw a view, computed without touching matplotlib
+    # artists so it can be prepared off the GUI thread. y may be None when
+    # the pyramid is coarse enough for the window of n_samples samples.
+    if n_samples is None:
+        n_samples = len(y)
+    if start_time is None:
+        start_time = 0.0
+
+    seg_starts, seg_ends, seg_codes, label_names = segments
+    counts = np.bincount(seg_codes, minlength=len(label_names))
+    code_of = {label_names[code]: code for code in np.flatnonzero(counts).tolist()}
+
+    # Generate a colormap with a large number of colors
+    labels = sorted(code_of)
+    num_labels = len(labels)
+    colormap = matplotlib.colormaps['tab20'].resampled(max(num_labels, 1))
+
+    # Create a dictionary to map each label to a unique color
+    colors = {label: colormap(i / num_labels) for i, label in enumerate(labels)}
+
+    # Only ever draw about as many points as the axes has pixels. The pyramid
+    # may cover the whole file, in which case y starts at sample_offset in it.
+    if pyramid is None:
+        pyramid = build_waveform_pyramid(y)
+        sample_offset = 0
+    level = select_pyramid_level(pyramid, n_samples, pixel_width)
+
+    # One trace is shared by every label: each label gets a copy with the
+    # samples outside its own turns masked out, so the number of artists is
+    # the number of speakers rather than the number of turns
+    if level is None:
+        positions, full_values = waveform_envelope(y, None, 0, n_samples, pixel_width)
+    else:
+        positions, full_values = waveform_envelope(y, level, sample_offset, sample_offset + n_samples, pixel_width)
+        positions = positions - sample_offset
+    full_times = positions / sr + start_time
+
+    # Segments grouped by label code with one stable sort, so that each
+    # label's are a slice. Codes narrowed to 16 bits are radix-sorted, and
+    # boundaries are searched in time order, which is faster, before being
+    # grouped.
+    narrow = seg_codes.astype(np.uint16) if len(label_names) <= 1 << 16 else seg_codes
+    order = np.argsort(narrow, kind='stable')
+    first = np.searchsorted(positions, seg_starts * sr, side='left')[order]
+    last = np.searchsorted(positions, seg_ends * sr, side='left')[order]
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+
+    traces = []
+    for label in labels:
+        code = code_of[label]
+        mine = slice(bounds[code], bounds[code + 1])
+
+        # Coverage count per point from +1/-1 steps at segment boundaries
+        steps = np.bincount(first[mine], minlength=len(positions) + 1) - np.bincount(last[mine], minlength=len(positions) + 1)
+        covered = np.cumsum(steps[:-1]) > 0
+
+        traces.append((label, full_times, np.where(covered, full_values, np.nan)))
+
+    peak = max(float(np.abs(full_values).max()) if len(full_values) else 0.0, 1e-3)
+
+    return {
+        "colors": colors,
+        "traces": traces,
+        "full": (full_times, full_values),
+        "xlim": (start_time, start_time + max(n_samples, 1) / sr),
+        "ylim": (-1.1 * peak, 1.1 * peak),
+    }
+
+def draw_waveform(ax, data):
+    for label, times, values in data["traces"]:
+        ax.plot(times, values, color=data["colors"][label], alpha=0.8, label=f'{label}')
+    ax.plot(*data["full"], color='gray', alpha=0.2, label='Full Audio')
+    ax.set_xlim(*data["xlim"])
+    ax.set_ylim(*data["ylim"])
+    style_waveform_axes(ax, data["colors"])
+
+def style_waveform_axes(ax, colors):
+    ax.set_title('Waveform')
+    ax.set_xlabel('Time (seconds)')
+    ax.set_ylabel('Amplitude')
+    ax.grid(True)
+
+    # Create a legend with unique labels
+    legend_handles = [Line2D([0], [0], color=colors[label], lw=4, label=f'{label}') for label in colors]
+    ax.legend(handles=legend_handles, loc='upper right')
+
+# Error regions drawn in strips under every compared lane, top to bottom
+ERROR_COLORS = {"missed": "#d62728", "false_alarm": "#ff7f0e", "confusion": "#9467bd"}
+ERROR_NAMES = {"missed": "Missed", "false_alarm": "False alarm", "confusion": "Confusion"}
+
+def _bars(starts, ends):
+    return np.column_stack([starts, ends - starts])
+
+def draw_lanes(ax, lanes, colors):
+    # One row per RTTM file, the reference on top, with its turns colored by
+    # label as in the waveform. Returns the artists so that the next view can
+    # remove them.
+    fallback = matplotlib.colormaps['tab20']
+    artists = []
+    for k, lane in enumerate(lanes):
+        starts, ends, codes = lane["bars"]
+        facecolors = [colors.get(lane["labels"][code], fallback(code % 20)) for code in codes.tolist()]
+        artists.append(ax.broken_barh(_bars(starts, ends), (-k - 0.5, 0.45), facecolors=facecolors, linewidth=0))
+        if lane["errors"] is None:
+            continue
+        for row, kind in enumerate(ERROR_COLORS):
+            starts, ends = lane["errors"][kind]
+            artists.append(ax.broken_barh(_bars(starts, ends), (-k - 0.95 + 0.14 * row, 0.12),
+                                          facecolors=ERROR_COLORS[kind], linewidth=0))
+
+    ax.set_ylim(-len(lanes), 0)
+    ax.set_yticks([-k - 0.5 for k in range(len(lanes))])
+    ax.set_yticklabels([lane["name"] + (" (reference)" if k == 0 else "") for k, lane in enumerate(lanes)], fontsize=7)
+    ax.set_xlabel('Time (seconds)')
+    legend_handles = [Patch(color=color, label=ERROR_NAMES[kind]) for kind, color in ERROR_COLORS.items()]
+    # Next to the lanes rather than over them
+    ax.legend(handles=legend_handles, loc='upper left', bbox_to_anchor=(1.005, 1.0), fontsize=6, frameon=False)
+    return artists
+
+# Raster engine: the lines of draw_waveform drawn straight into an RGBA array
+# of one pixel per axes pixel, instead of as Line2D paths through Agg. Each
+# line is reduced to the lowest and highest value it reaches in every pixel
+# column, and that vertical span of the column, widened by the line width
+# Line2D strokes with, is filled. Colors are
+# premultiplied by their alpha and pixels nothing is drawn on stay
+# transparent, so the array can be painted over the axes as it is.
+RASTER_TRACE_ALPHA = 0.8
+RASTER_FULL_COLOR = matplotlib.colors.to_rgb('gray')
+RASTER_FULL_ALPHA = 0.2
+# Up to this many lines, the color of every combination of lines is
+# computed up front; with more, only of the combinations that occur
+RASTER_PALETTE_LINES = 12
+# Lines sharing one int64 bit mask; views with more lines are rasterized in
+# layers of this many, composited in drawing order
+RASTER_MASK_LINES = 63
+
+def _column_spans(columns, values, width, reach=0):
+    # Lowest and highest value of the polyline through (columns, values) in
+    # each of width pixel columns, NaN where it does not pass. NaN values
+    # break the line, as they do in Line2D. With a reach, every column also
+    # spans the columns up to that many pixels away, as a stroke that wide
+    # would cover them.
+    edges = np.arange(width + 1)
+    at_edges = np.interp(edges, columns, values, left=np.nan, right=np.nan)
+    lows = np.fmin(at_edges[:-1], at_edges[1:])
+    highs = np.fmax(at_edges[:-1], at_edges[1:])
+
+    # Points inside a column widen its span; columns is sorted
+    bounds = np.searchsorted(columns, edges)
+    inside = bounds[1:] > bounds[:-1]
+    if inside.any():
+        first = bounds[:-1][inside]
+        values = values[:bounds[-1]]
+        lows[inside] = np.fmin(lows[inside], np.fmin.reduceat(values, first))
+        highs[inside] = np.fmax(highs[inside], np.fmax.reduceat(values, first))
+
+    near_lows, near_highs = lows.copy(), highs.copy()
+    for k in range(1, min(reach, width - 1) + 1):
+        near_lows[k:] = np.fmin(near_lows[k:], lows[:-k])
+        near_lows[:-k] = np.fmin(near_lows[:-k], lows[k:])
+        near_highs[k:] = np.fmax(near_highs[k:], highs[:-k])
+        near_highs[:-k] = np.fmax(near_highs[:-k], highs[k:])
+    return near_lows, near_highs
+
+def rasterize_waveform(data, width, height, dpi=100):
+    # Image of the lines of a view's plot data, height x width x 4 uint8,
+    # for axes spanning data["xlim"] and data["ylim"] at the given dpi.
+    #
+    # Every pixel gets one bit per line covering it: line k adds 2**k at the
+    # top of its span in each column and removes it below the bottom, and a
+    # cumulative sum down the rows yields the bits. The color of each
+    # combination of bits is then composited once, in the order draw_waveform
+    # draws the lines, and looked up for every pixel.
+    width = max(int(width), 1)
+    height = max(int(height), 1)
+    lines = [(times, values, data["colors"][label][:3], RASTER_TRACE_ALPHA) for label, times, values in data["traces"]]
+    lines.append((*data["full"], RASTER_FULL_COLOR, RASTER_FULL_ALPHA))
+    half_line = matplotlib.rcParams['lines.linewidth'] * dpi / 72 / 2
+
+    if len(lines) <= RASTER_MASK_LINES:
+        palette, codes = _raster_layer(lines, data["xlim"], data["ylim"], width, height, half_line)
+        return np.round(palette * 255).astype(np.uint8)[codes]
+
+    image = np.zeros((height, width, 4), dtype=np.float32)
+    for first in range(0, len(lines), RASTER_MASK_LINES):
+        palette, codes = _raster_layer(lines[first:first + RASTER_MASK_LINES], data["xlim"], data["ylim"],
+                                       width, height, half_line)
+        layer = palette[codes]
+        image *= 1 - layer[..., 3:]
+        image += layer
+    return np.round(image * 255).astype(np.uint8)
+
+def _raster_layer(lines, xlim, ylim, width, height, half_line):
+    # Premultiplied float palette of up to RASTER_MASK_LINES lines and the
+    # index into it of every pixel
+    x0, x1 = xlim
+    y0, y1 = ylim
+    steps = np.zeros((height + 1, width), dtype=np.int64)
+    all_columns = np.arange(width)
+    for bit, (times, values, _, _) in enumerate(lines):
+        if len(times) == 0:
+            continue
+        lows, highs = _column_spans((times - x0) * (width / (x1 - x0)), values, width, int(half_line))
+        drawn = ~np.isnan(lows)
+        top = np.clip(np.floor((y1 - highs[drawn]) * (height / (y1 - y0)) - half_line), 0, height - 1).astype(np.intp)
+        bottom = np.clip(np.ceil((y1 - lows[drawn]) * (height / (y1 - y0)) + half_line), top + 1, height).astype(np.intp)
+        columns = all_columns[drawn]
+        # One top and one bottom per column, so no index repeats within a line
+        steps[top, columns] += 1 << bit
+        steps[bottom, columns] -= 1 << bit
+    codes = np.cumsum(steps[:-1], axis=0)
+
+    if len(lines) <= RASTER_PALETTE_LINES:
+        combinations = np.arange(1 << len(lines))
+    else:
+        combinations, codes = np.unique(codes, return_inverse=True)
+        codes = codes.reshape(height, width)
+    palette = np.zeros((len(combinations), 4), dtype=np.float32)
+    for bit, (_, _, color, alpha) in enumerate(lines):
+        covered = (combinations >> bit) & 1 == 1
+        palette[covered] = palette[covered] * (1 - alpha) + np.array([*color, 1.0], dtype=np.float32) * alpha
+    return palette, codes
+
+def plot_waveform(y, sr, segments, start_time, pyramid=None, sample_offset=0, pixel_width=None, timer=None):
+    # A bare Figure rather than pyplot, so this can run off the GUI thread and
+    # is freed as soon as the caller drops it
+    fig = Figure(figsize=(14, 5))
+    ax = fig.subplots()
+
+    if pixel_width is None:
+        pixel_width = ax.get_window_extent().width
+    with stage_span(timer, "plot_data") as counters:
+        data = waveform_plot_data(y, sr, segments, start_time, pyramid, sample_offset, pixel_width)
+        counters["points"] = plot_data_points(data)
+    with stage_span(timer, "artists"):
+        draw_waveform(ax, data)
+
+    return fig
+
+
+# Extra audio decoded on each side of a requested window, in seconds
+AUDIO_READ_MARGIN = 0.5
+# Frames decoded per read, between two checks for cancellation. Cached audio
+# is stored in chunks of this size, aligned on multiples of it.
+AUDIO_READ_BLOCK = 1 << 18
+# Memory allowed for decoded audio, RTTM indexes and pyramids kept in memory
+CACHE_BUDGET = 512 * 1024 * 1024
+
+class LoadCancelled(Exception):
+    pass
+
+class LRUCache:
+    # Thread-safe least-recently-used cache that evicts entries once the sum
+    # of their sizes exceeds max_bytes
+    def __init__(self, max_bytes=CACHE_BUDGET):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value, nbytes):
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self.entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+
+    def resize(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self.entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+# Number of timing spans kept by a StageTimer; older ones are dropped
+MAX_TIMING_SPANS = 10000
+
+class StageTimer:
+    # Records named wall-clock spans with counters (points drawn, bytes
+    # decoded, ...) from any thread. tagged() returns a timer that shares the
+    # same spans but adds its tags to each of them, e.g. the view they belong to.
+    def __init__(self, max_spans=MAX_TIMING_SPANS):
+        self.spans = deque(maxlen=max_spans)
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.tags = {}
+
+    def tagged(self, **tags):
+        timer = StageTimer.__new__(StageTimer)
+        timer.spans = self.spans
+        timer.lock = self.lock
+        timer.origin = self.origin
+        timer.tags = {**self.tags, **tags}
+        return timer
+
+    @contextmanager
+    def span(self, name, **counters):
+        # The yielded dict can be filled with counters known only at the end
+        counters = dict(counters)
+        started = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            ended = time.perf_counter()
+            with self.lock:
+                self.spans.append({
+                    "name": name,
+                    "start": started - self.origin,
+                    "duration": ended - started,
+                    "thread": threading.get_ident(),
+                    **self.tags,
+                    **counters,
+                })
+
+    def select(self, **tags):
+        with self.lock:
+            return [span for span in self.spans if all(span.get(key) == value for key, value in tags.items())]
+
+    def summary(self, **tags):
+        # One line per span, in the order they finished
+        lines = []
+        for span in self.select(**tags):
+            counters = ", ".join(f"{key}={value}" for key, value in span.items()
+                                 if key not in ("name", "start", "duration", "thread") and key not in self.tags and key not in tags)
+            lines.append(f"{span['name']:<12}{span['duration'] * 1000:9.1f} ms  {counters}".rstrip())
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        # Trace Event Format, as read by chrome://tracing and Perfetto
+        events = []
+        for span in self.select():
+            args = {key: value for key, value in span.items() if key not in ("name", "start", "duration", "thread")}
+            events.append({
+                "name": span["name"],
+                "ph": "X",
+                "ts": span["start"] * 1e6,
+                "dur": span["duration"] * 1e6,
+                "pid": os.getpid(),
+                "tid": span["thread"],
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, filename, chrome=False):
+        with open(filename, 'w') as file:
+            json.dump(self.chrome_trace() if chrome else self.select(), file, indent=1)
+
+def stage_span(timer, name, **counters):
+    # Times a stage when a timer is given and costs nothing otherwise
+    return nullcontext({}) if timer is None else timer.span(name, **counters)
+
+def file_identity(filename):
+    # Cache entries are dropped implicitly when the file is modified
+    stat = os.stat(filename)
+    return (os.path.realpath(filename), stat.st_mtime_ns, stat.st_size)
+
+def get_audio_duration(filename):
+    # Read from the file header, so nothing has to be decoded
+    info = sf.info(filename)
+    return info.frames / info.samplerate
+
+def _read_frames(audio_file, start_frame, n_frames):
+    audio_file.seek(start_frame)
+    block = audio_file.read(n_frames, dtype='float32', always_2d=True)
+
+    # Downmix to mono the same way librosa.load does
+    return block[:, 0] if block.shape[1] == 1 else block.mean(axis=1, dtype=np.float32)
+
+# Optional sidecar files written next to the WAV: the decoded mono samples as
+# a memory-mappable .npy, and the waveform pyramid of the whole file
+def pcm_sidecar_path(filename):
+    return filename + ".pcm.npy"
+
+def pyramid_sidecar_path(filename):
+    return filename + ".pyramid.npz"
+
+def load_pcm_sidecar(filename, n_frames):
+    # The sidecar is given the exact modification time of the WAV it was
+    # decoded from. A WAV replaced since, even by an older file (cp -p,
+    # rsync -a, an archive), has another one.
+    sidecar = pcm_sidecar_path(filename)
+    try:
+        if os.stat(sidecar).st_mtime_ns != os.stat(filename).st_mtime_ns:
+            return None
+        pcm = np.load(sidecar, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    return pcm if pcm.shape == (n_frames,) else None
+
+def _partial_file(path, suffix=".part"):
+    # A new file next to path, for one writer only: writers of the same file
+    # (e.g. a cancelled loader and the one replacing it) never write to or
+    # remove each other's partial file, and the last to finish is the one
+    # kept. It is created with the permissions open() would give it under the
+    # umask, unlike mkstemp's owner-only ones, since os.replace keeps them.
+    while True:
+        partial = f"{path}.{os.urandom(4).hex()}{suffix}"
+        try:
+            os.close(os.open(partial, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+            return partial
+        except FileExistsError:
+            continue
+
+def write_pcm_sidecar(filename, should_stop=None):
+    # Streams the decoded samples into the sidecar; the file only gets its
+    # final name once complete, so readers never see a partial one
+    sidecar = pcm_sidecar_path(filename)
+    partial = _partial_file(sidecar)
+    # Taken before decoding, so that a WAV modified meanwhile leaves the
+    # sidecar stale
+    stat = os.stat(filename)
+    try:
+        with sf.SoundFile(filename) as audio_file:
+            pcm = np.lib.format.open_memmap(partial, mode='w+', dtype=np.float32, shape=(audio_file.frames,))
+            for offset in range(0, audio_file.frames, AUDIO_READ_BLOCK):
+                if should_stop is not None and should_stop():
+                    raise LoadCancelled()
+                block = _read_frames(audio_file, offset, min(AUDIO_READ_BLOCK, audio_file.frames - offset))
+                pcm[offset:offset + len(block)] = block
+            pcm.flush()
+            del pcm
+        os.utime(partial, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(partial, sidecar)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return np.load(sidecar, mmap_mode='r')
+
+def load_pyramid_sidecar(filename):
+    # Only used when the size and modification time of the WAV, and its
+    # frame count and sample rate, are those the pyramid was built from.
+    # Sidecars without them, from older versions, are rebuilt.
+    sidecar = pyramid_sidecar_path(filename)
+    try:
+        stat = os.stat(filename)
+        info = sf.info(filename)
+        with np.load(sidecar) as data:
+            if (int(data["source_size"]) != stat.st_size or int(data["source_mtime_ns"]) != stat.st_mtime_ns
+                    or int(data["n_samples"]) != info.frames or int(data["sample_rate"]) != info.samplerate):
+                return None
+            levels = []
+            for i in range(int(data["n_levels"])):
+                levels.append({
+                    "block": int(data[f"block_{i}"]),
+                    "min": data[f"min_{i}"],
+                    "max": data[f"max_{i}"],
+                    "rms": data[f"rms_{i}"],
+                })
+            return {"n_samples": int(data["n_samples"]), "levels": levels}
+    except (OSError, ValueError, KeyError, RuntimeError):
+        return None
+
+def write_pyramid_sidecar(filename, pyramid):
+    stat = os.stat(filename)
+    arrays = {
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "sample_rate": sf.info(filename).samplerate,
+        "n_samples": pyramid["n_samples"],
+        "n_levels": len(pyramid["levels"]),
+    }
+    for i, level in enumerate(pyramid["levels"]):
+        arrays[f"block_{i}"] = level["block"]
+        arrays[f"min_{i}"] = level["min"]
+        arrays[f"max_{i}"] = level["max"]
+        arrays[f"rms_{i}"] = level["rms"]
+    partial = _partial_file(pyramid_sidecar_path(filename), ".part.npz")
+    try:
+        np.savez(partial, **arrays)
+        os.replace(partial, pyramid_sidecar_path(filename))
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+def read_audio_range(filename, start_time=None, end_time=None, margin=AUDIO_READ_MARGIN, should_stop=None, cache=None):
+    # Decode only [start_time - margin, end_time + margin) by seeking to the
+    # first frame. Returns the mono samples, the sample rate and the time of
+    # the first returned sample. should_stop is polled between blocks and
+    # aborts the read with LoadCancelled.
+    #
+    # With a cache, a fresh PCM sidecar is sliced directly (a view on the
+    # memory map) and otherwise decoded blocks are kept for later windows.
+    with sf.SoundFile(filename) as audio_file:
+        sr = audio_file.samplerate
+        start_frame = 0 if start_time is None else max(int((start_time - margin) * sr), 0)
+        end_frame = audio_file.frames if end_time is None else min(int(np.ceil((end_time + margin) * sr)), audio_file.frames)
+        end_frame = max(end_frame, start_frame)
+
+        if cache is not None:
+            identity = file_identity(filename)
+            pcm = cache.get(("pcm", identity))
+            if pcm is None:
+                pcm = load_pcm_sidecar(filename, audio_file.frames)
+                if pcm is not None:
+                    # Mapped pages belong to the OS page cache, not to the budget
+                    cache.put(("pcm", identity), pcm, 0)
+            if pcm is not None:
+                return pcm[start_frame:end_frame], sr, start_frame / sr
+
+        y = np.empty(end_frame - start_frame, dtype=np.float32)
+        block_start = start_frame - start_frame % AUDIO_READ_BLOCK if cache is not None else start_frame
+        for block_start in range(block_start, end_frame, AUDIO_READ_BLOCK):
+            if should_stop is not None and should_stop():
+                raise LoadCancelled()
+
+            if cache is not None:
+                key = ("audio", identity, block_start)
+                block = cache.get(key)
+                if block is None:
+                    block = _read_frames(audio_file, block_start, min(AUDIO_READ_BLOCK, audio_file.frames - block_start))
+                    cache.put(key, block, block.nbytes)
+            else:
+                block = _read_frames(audio_file, block_start, min(AUDIO_READ_BLOCK, end_frame - block_start))
+
+            lo = max(start_frame, block_start)
+            hi = min(end_frame, block_start + len(block))
+            y[lo - start_frame:hi - start_frame] = block[lo - block_start:hi - block_start]
+
+    return y, sr, start_frame / sr
+
+# Sample formats of a WAV "fmt " chunk that numpy can map as they are stored,
+# by (format tag, bits per sample). 8-bit WAV is unsigned and 24-bit has no
+# numpy dtype, so both are read through soundfile instead.
+WAV_FORMAT_EXTENSIBLE = 0xFFFE
+WAV_DTYPES = {(1, 16): "<i2", (1, 32): "<i4", (3, 32): "<f4", (3, 64): "<f8"}
+
+def wav_data_layout(filename, growing=False):
+    # Offset, dtype, channels and frame count of the samples of a plain RIFF
+    # WAV file, found by walking its chunks, and its raw "fmt " chunk. None
+    # for anything else. A growing file is still being written, and its
+    # samples run to the end of the file whatever size its header gives.
+    with open(filename, 'rb') as file:
+        header = file.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+        fmt = None
+        while True:
+            chunk = file.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = chunk[:4], int.from_bytes(chunk[4:], 'little')
+            if chunk_id == b'data':
+                break
+            # Chunks are padded to an even size
+            if chunk_id == b'fmt ':
+                fmt = file.read(size)
+                file.seek(size % 2, os.SEEK_CUR)
+            else:
+                file.seek(size + size % 2, os.SEEK_CUR)
+        offset = file.tell()
+        if fmt is None or len(fmt) < 16:
+            return None
+
+    format_tag = int.from_bytes(fmt[0:2], 'little')
+    channels = int.from_bytes(fmt[2:4], 'little')
+    bits = int.from_bytes(fmt[14:16], 'little')
+    if format_tag == WAV_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        format_tag = int.from_bytes(fmt[24:26], 'little')
+    dtype = WAV_DTYPES.get((format_tag, bits))
+    if dtype is None or channels == 0:
+        return None
+
+    # Streaming writers leave the data size unset (zero or all ones) until
+    # they are done, so it is capped by the file
+    frame_bytes = channels * bits // 8
+    if growing or size in (0, 0xFFFFFFFF):
+        size = os.path.getsize(filename) - offset
+    size = min(size, os.path.getsize(filename) - offset)
+    return {"offset": offset, "dtype": np.dtype(dtype), "channels": channels, "frames": size // frame_bytes, "fmt": fmt}
+
+def _wav_header_is_complete(filename):
+    # False while the file ends before the start of its "data" chunk, i.e. a
+    # writer has not written its whole header yet. Files that are not RIFF
+    # WAV at all are complete; wav_data_layout tells whether they can be read.
+    with open(filename, 'rb') as file:
+        header = file.read(12)
+        if len(header) < 12:
+            return False
+        if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return True
+        while True:
+            chunk = file.read(8)
+            if len(chunk) < 8:
+                return False
+            if chunk[:4] == b'data':
+                return True
+            size = int.from_bytes(chunk[4:], 'little')
+            file.seek(size + size % 2, os.SEEK_CUR)
+
+def open_pcm_memmap(filename, layout=None):
+    # Samples of a WAV file mapped in their stored format, shaped (frames,
+    # channels); slicing it reads only the pages of the sliced frames
+    if layout is None:
+        layout = wav_data_layout(filename)
+    if layout is None or layout["frames"] == 0:
+        return None
+    return np.memmap(filename, dtype=layout["dtype"], mode='r', offset=layout["offset"],
+                     shape=(layout["frames"], layout["channels"]))
+
+# Stored sample formats soundfile reads without converting them, as the dtype
+# they are read as and the factor that scales them to [-1, 1). Other formats
+# are read as float32.
+NATIVE_DTYPES = {
+    "PCM_16": ("int16", 2.0 ** -15),
+    "PCM_24": ("int32", 2.0 ** -31),
+    "PCM_32": ("int32", 2.0 ** -31),
+    "FLOAT": ("float32", 1.0),
+    "DOUBLE": ("float64", 1.0),
+}
+# Frames per block when audio is streamed in its stored format
+STREAM_BLOCK = 1 << 16
+
+def native_blocks(filename, start_frame=0, end_frame=None, block_frames=STREAM_BLOCK, should_stop=None, layout=None):
+    # Yields consecutive blocks of mono samples of [start_frame, end_frame)
+    # in their stored type, each block_frames long but the last. A single
+    # block buffer is read into again and again, so a consumer must be done
+    # with a block before asking for the next one. Plain WAV samples are read
+    # from the file with readinto, and other formats through soundfile.
+    # Returns the generator and the scale of its samples. A layout from
+    # wav_data_layout can be given, e.g. one of a growing file.
+    if layout is None:
+        layout = wav_data_layout(filename)
+    if layout is not None:
+        dtype = layout["dtype"]
+        n_frames = layout["frames"]
+        channels = layout["channels"]
+        scale = 2.0 ** (1 - 8 * dtype.itemsize) if dtype.kind == 'i' else 1.0
+    else:
+        info = sf.info(filename)
+        dtype, scale = NATIVE_DTYPES.get(info.subtype, ("float32", 1.0))
+        n_frames = info.frames
+        channels = info.channels
+    end_frame = n_frames if end_frame is None else min(end_frame, n_frames)
+
+    def blocks():
+        buffer = np.empty((min(block_frames, max(end_frame - start_frame, 0)), channels), dtype=dtype)
+        with open(filename, 'rb') if layout is not None else sf.SoundFile(filename) as file:
+            if layout is not None:
+                file.seek(layout["offset"] + start_frame * channels * buffer.itemsize)
+            else:
+                file.seek(start_frame)
+            for offset in range(start_frame, end_frame, block_frames):
+                if should_stop is not None and should_stop():
+                    raise LoadCancelled()
+                block = buffer[:min(block_frames, end_frame - offset)]
+                if layout is not None:
+                    file.readinto(block)
+                else:
+                    file.read(len(block), dtype=dtype, always_2d=True, out=block)
+                # Downmixed to mono the same way _read_frames does
+                yield block[:, 0] if channels == 1 else block.mean(axis=1, dtype=np.float32)
+
+    return blocks(), scale
+
+# Low-memory mode sizes everything that grows with the length of a recording
+# from one budget, so memory use stays bounded however long it is
+LOW_MEMORY_BUDGET = 256 * 1024 * 1024
+# Upper bound of the memory a pyramid takes per level-0 bin while it is
+# built: min, max and rms as float32, the float64 sums of squares, and the
+# coarser levels
+PYRAMID_BUILD_BYTES_PER_BIN = 32
+
+class MemoryBudget:
+    # Half of the budget goes to the LRU cache (decoded blocks, RTTM indexes
+    # and pyramids), a quarter to the whole-file pyramid, whose base block
+    # grows with the recording until it fits, and a quarter to the samples of
+    # one decoded window. Wider windows are summarised block by block while
+    # streaming their samples instead of being decoded.
+    def __init__(self, max_bytes=LOW_MEMORY_BUDGET):
+        self.max_bytes = max_bytes
+
+    @property
+    def cache_bytes(self):
+        return self.max_bytes // 2
+
+    @property
+    def pyramid_bytes(self):
+        return self.max_bytes // 4
+
+    @property
+    def window_bytes(self):
+        return self.max_bytes // 4
+
+    def pyramid_base_block(self, n_samples):
+        block = FILE_PYRAMID_BASE_BLOCK
+        while -(-n_samples // block) * PYRAMID_BUILD_BYTES_PER_BIN > self.pyramid_bytes:
+            block *= PYRAMID_FACTOR
+        return block
+
+    def fits_window(self, n_samples):
+        return n_samples * np.dtype(np.float32).itemsize <= self.window_bytes
+
+def build_native_pyramid(filename, start_frame=0, n_frames=None, base_block=FILE_PYRAMID_BASE_BLOCK, should_stop=None):
+    # Pyramid of [start_frame, start_frame + n_frames) built from the stored
+    # samples in fixed-size blocks; memory use does not depend on n_frames
+    if n_frames is None:
+        n_frames = sf.info(filename).frames - start_frame
+    chunk = max(STREAM_BLOCK // base_block, 1) * base_block
+    blocks, scale = native_blocks(filename, start_frame, start_frame + n_frames, chunk, should_stop)
+    return build_pyramid_from_chunks(blocks, n_frames, base_block, scale=scale)
+
+# Binary segment store written next to an RTTM file: a magic number, the
+# size of a JSON header with the label table and the identity of the source
+# file, then the sorted index columns, each aligned so that they can be
+# memory-mapped in place. Version 02 stores only hold SPEAKER records.
+SEGMENT_STORE_MAGIC = b"AWDSEG02"
+SEGMENT_STORE_ALIGN = 64
+SEGMENT_STORE_COLUMNS = (("starts", "<f8"), ("durations", "<f8"), ("max_ends", "<f8"), ("codes", "<i4"))
+
+def segment_store_path(filename):
+    return filename + ".segments"
+
+def _store_align(offset):
+    return -(-offset // SEGMENT_STORE_ALIGN) * SEGMENT_STORE_ALIGN
+
+def write_segment_store(filename, rttm_index):
+    stat = os.stat(filename)
+    columns = []
+    offset = 0
+    for name, dtype in SEGMENT_STORE_COLUMNS:
+        columns.append({"name": name, "dtype": dtype, "offset": offset})
+        offset = _store_align(offset + len(rttm_index) * np.dtype(dtype).itemsize)
+    header = json.dumps({
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "turns": len(rttm_index),
+        "labels": rttm_index.labels,
+        "columns": columns,
+    }).encode()
+    data_start = _store_align(len(SEGMENT_STORE_MAGIC) + 8 + len(header))
+
+    store = segment_store_path(filename)
+    partial = _partial_file(store)
+    try:
+        with open(partial, 'wb') as file:
+            file.write(SEGMENT_STORE_MAGIC)
+            file.write(len(header).to_bytes(8, 'little'))
+            file.write(header)
+            for column in columns:
+                file.seek(data_start + column["offset"])
+                file.write(np.ascontiguousarray(getattr(rttm_index, column["name"]), dtype=column["dtype"]).tobytes())
+        os.replace(partial, store)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+def load_segment_store(filename):
+    # The RTTMIndex of filename memory-mapped from its segment store, or None
+    # when there is no store or the RTTM changed since it was written. Only
+    # the pages a query touches are ever read.
+    store = segment_store_path(filename)
+    try:
+        with open(store, 'rb') as file:
+            if file.read(len(SEGMENT_STORE_MAGIC)) != SEGMENT_STORE_MAGIC:
+                return None
+            header_size = int.from_bytes(file.read(8), 'little')
+            header = json.loads(file.read(header_size))
+        stat = os.stat(filename)
+        if header["source_size"] != stat.st_size or header["source_mtime_ns"] != stat.st_mtime_ns:
+            return None
+
+        n_turns = header["turns"]
+        data_start = _store_align(len(SEGMENT_STORE_MAGIC) + 8 + header_size)
+        raw = np.memmap(store, dtype=np.uint8, mode='r') if n_turns else np.empty(0, dtype=np.uint8)
+        columns = {}
+        for column in header["columns"]:
+            dtype = np.dtype(column["dtype"])
+            start = data_start + column["offset"]
+            columns[column["name"]] = raw[start:start + n_turns * dtype.itemsize].view(dtype)
+        if any(len(values) != n_turns for values in columns.values()):
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return RTTMIndex.from_sorted(columns["starts"], columns["durations"], columns["codes"],
+                                 header["labels"], columns["max_ends"])
+
+def open_rttm_index(filename, use_store=True):
+    # From the segment store when it is up to date; otherwise the text is
+    # parsed and the store written for the next time
+    if not use_store:
+        return parse_rttm(filename)
+    rttm_index = load_segment_store(filename)
+    if rttm_index is None:
+        rttm_index = parse_rttm(filename)
+        try:
+            write_segment_store(filename, rttm_index)
+        except OSError:
+            # e.g. a read-only directory: the text is parsed again next time
+            pass
+    return rttm_index
+
+def load_rttm_index(filename, cache=None, use_store=True):
+    if cache is None:
+        return open_rttm_index(filename, use_store)
+    key = ("rttm", file_identity(filename))
+    rttm_index = cache.get(key)
+    if rttm_index is None:
+        rttm_index = open_rttm_index(filename, use_store)
+        cache.put(key, rttm_index, rttm_index.nbytes)
+    return rttm_index
+
+def build_file_pyramid(filename, should_stop=None, base_block=FILE_PYRAMID_BASE_BLOCK):
+    # Streams the file once, block by block, so memory use does not depend
+    # on the length of the recording
+    return build_native_pyramid(filename, base_block=base_block, should_stop=should_stop)
+
+def load_file_pyramid(filename, cache, write_sidecar=False, should_stop=None, build=False, budget=None):
+    # Pyramid of the whole file, from memory or from its sidecar. When
+    # sidecars are enabled it is otherwise built from the PCM sidecar and
+    # saved; with build it is otherwise built by streaming the file. Returns
+    # None when none of these applies.
+    #
+    # With a MemoryBudget the pyramid is kept within its share: it is built
+    # from the stored samples with a large enough base block, no decoded PCM
+    # sidecar is written, and a finer sidecar is trimmed.
+    key = ("pyramid", file_identity(filename))
+    pyramid = cache.get(key)
+    if pyramid is not None:
+        return pyramid
+
+    pyramid = load_pyramid_sidecar(filename)
+    if pyramid is not None and budget is not None:
+        pyramid = trim_pyramid(pyramid, budget.pyramid_bytes)
+    if pyramid is None and budget is not None and (write_sidecar or build):
+        pyramid = build_file_pyramid(filename, should_stop, budget.pyramid_base_block(sf.info(filename).frames))
+        if write_sidecar:
+            write_pyramid_sidecar(filename, pyramid)
+    elif pyramid is None and write_sidecar:
+        pcm = load_pcm_sidecar(filename, sf.info(filename).frames)
+        if pcm is None:
+            pcm = write_pcm_sidecar(filename, should_stop)
+        pyramid = build_waveform_pyramid(pcm, FILE_PYRAMID_BASE_BLOCK)
+        write_pyramid_sidecar(filename, pyramid)
+    elif pyramid is None and build:
+        pyramid = build_file_pyramid(filename, should_stop)
+    if pyramid is not None:
+        cache.put(key, pyramid, pyramid_nbytes(pyramid))
+    return pyramid
+
+def split_audio_and_rttm(y, sr, rttm_lines, start_time, duration, y_start_time=0.0, total_duration=None):
+    # y may be a partial decode that begins at y_start_time instead of at zero
+    if total_duration is None:
+        total_duration = y_start_time + len(y) / sr
+
+    # Calculate the end time of the segment, ensuring it does not exceed the total duration
+    end_time = min(start_time + duration, total_duration)
+    start_sample = max(int((start_time - y_start_time) * sr), 0)
+    end_sample = max(int((end_time - y_start_time) * sr), start_sample)
+
+    # Extract the audio segment
+    segment = y[start_sample:end_sample]
+
+    # Only the segments overlapping the window are visited
+    if not isinstance(rttm_lines, RTTMIndex):
+        rttm_lines = RTTMIndex.from_lines(rttm_lines)
+    segments = rttm_lines.segments(start_time, end_time)
+
+    return segment, sr, segments
+
+def load_view(filename_wav, filename_rttm, start_time, end_time, pixel_width, cache=None, pyramid=None,
+              should_stop=None, progress=None, timer=None, budget=None):
+    # Plot data for [start_time, end_time) of a WAV/RTTM pair. When a whole-
+    # file pyramid is given and is coarse enough for the window, no audio is
+    # decoded at all, so the cost depends on the screen width only.
+    #
+    # A window of most of the file costs about as much as the whole-file
+    # pyramid, which is then built by streaming the file instead of decoding
+    # the window, and serves every later view. With a MemoryBudget, other
+    # windows too wide to be decoded within it are summarised from their
+    # stored samples in fixed-size blocks.
+    info = sf.info(filename_wav)
+    sr = info.samplerate
+    total_duration = info.frames / sr
+    start_time = 0.0 if start_time is None else max(start_time, 0.0)
+    end_time = total_duration if end_time is None else min(end_time, total_duration)
+    start_sample = int(start_time * sr)
+    n_samples = max(int(end_time * sr) - start_sample, 0)
+    from_pyramid = pyramid is not None and select_pyramid_level(pyramid, n_samples, pixel_width) is not None
+    streamed = budget is not None and not from_pyramid and not budget.fits_window(n_samples)
+    # Without a budget, only when the pyramid will be coarse enough for it
+    overview = budget is None and not from_pyramid and n_samples >= FILE_PYRAMID_BASE_BLOCK * max(int(pixel_width), 1)
+    if (streamed or overview) and pyramid is None and cache is not None and 2 * n_samples >= info.frames:
+        if progress is not None:
+            progress("Building waveform overview...")
+        with stage_span(timer, "pyramid_build"):
+            pyramid = load_file_pyramid(filename_wav, cache, should_stop=should_stop, build=True, budget=budget)
+        from_pyramid = select_pyramid_level(pyramid, n_samples, pixel_width) is not None
+        streamed = streamed and not from_pyramid
+
+    y = None
+    if streamed:
+        if progress is not None:
+            progress("Streaming audio...")
+        with stage_span(timer, "stream") as counters:
+            base_block = min(max(n_samples // max(int(pixel_width), 1), 1), STREAM_BLOCK)
+            pyramid = build_native_pyramid(filename_wav, start_sample, n_samples, base_block, should_stop)
+            counters["samples"] = n_samples
+            counters["bins"] = len(pyramid["levels"][0]["min"]) if pyramid["levels"] else 0
+    elif not from_pyramid:
+        if progress is not None:
+            progress("Decoding audio...")
+        with stage_span(timer, "decode") as counters:
+            y, sr, y_start_time = read_audio_range(filename_wav, start_time, end_time, should_stop=should_stop, cache=cache)
+            counters["samples"] = len(y)
+            counters["bytes"] = y.nbytes
+    if should_stop is not None and should_stop():
+        raise LoadCancelled()
+
+    if progress is not None:
+        progress("Indexing RTTM...")
+    with stage_span(timer, "rttm_index") as counters:
+        rttm_index = load_rttm_index(filename_rttm, cache)
+        counters["turns"] = len(rttm_index)
+    with stage_span(timer, "split") as counters:
+        if from_pyramid or streamed:
+            segments = rttm_index.segments(start_time, end_time)
+        else:
+            y, sr, segments = split_audio_and_rttm(y, sr, rttm_index, start_time, end_time - start_time,
+                                                   y_start_time, total_duration)
+            n_samples = len(y)
+        counters["segments"] = len(segments[0])
+    if should_stop is not None and should_stop():
+        raise LoadCancelled()
+
+    if progress is not None:
+        progress("Rendering waveform...")
+    # Below the file pyramid's finest level a pyramid of the decoded window is
+    # used, and a streamed window's pyramid starts at the window
+    if streamed:
+        start_sample = 0
+    elif not from_pyramid:
+        pyramid = None
+    with stage_span(timer, "plot_data") as counters:
+        data = waveform_plot_data(y, sr, segments, start_time, pyramid, start_sample, pixel_width, n_samples)
+        counters["points"] = plot_data_points(data)
+    return data
+
+def plot_data_points(data):
+    return len(data["full"][0]) * (len(data["traces"]) + 1)
+
+
+# Follow mode: a WAV and an RTTM file that a running diarizer keeps appending
+# to. Every update reads only the bytes appended since the one before, and
+# adds them to a pyramid and an RTTM index that grow in place, so its cost
+# depends on the new data rather than on the length of the recording.
+#
+# Decoded samples of the end of the recording, for views too short to be
+# drawn from the pyramid on any screen
+FOLLOW_TAIL_FRAMES = FILE_PYRAMID_BASE_BLOCK * 4096
+
+def _grown(array, size):
+    # array with room for at least size items, doubling its capacity so that
+    # appending costs amortised constant time per item
+    if size <= len(array):
+        return array
+    grown = np.empty(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+class GrowingPyramid:
+    # Waveform pyramid of a signal that is only ever appended to. Every level
+    # keeps the sums of squares of its bins, so that the last, partial bin
+    # can be completed by the next samples; each coarser level is then
+    # recomputed from the first bin of the finer one that changed.
+    # snapshot() gives the same levels as build_pyramid_from_chunks.
+    def __init__(self, base_block=FILE_PYRAMID_BASE_BLOCK, factor=PYRAMID_FACTOR):
+        self.base_block = base_block
+        self.factor = factor
+        self.n_samples = 0
+        self.levels = []
+
+    def _new_level(self, block):
+        level = {"block": block, "n": 0,
+                 "min": np.empty(0, dtype=np.float32), "max": np.empty(0, dtype=np.float32),
+                 "rms": np.empty(0, dtype=np.float32), "sumsq": np.empty(0, dtype=np.float64)}
+        self.levels.append(level)
+        return level
+
+    def _store(self, level, first, mins, maxs, sumsq):
+        # Writes bins first, first + 1, ... of level, the last of which ends
+        # at n_samples
+        end = first + len(mins)
+        for key in ("min", "max", "rms", "sumsq"):
+            level[key] = _grown(level[key], end)
+        counts = np.full(len(mins), level["block"])
+        counts[-1] = self.n_samples - (end - 1) * level["block"]
+        level["min"][first:end] = mins
+        level["max"][first:end] = maxs
+        level["sumsq"][first:end] = sumsq
+        level["rms"][first:end] = np.sqrt(sumsq / counts)
+        level["n"] = end
+
+    def append(self, samples, scale=1.0):
+        # Integer PCM samples are reduced as they are, as in
+        # build_pyramid_from_chunks, and only the bins are multiplied by scale
+        samples = np.asarray(samples)
+        if len(samples) == 0:
+            return
+        if not self.levels:
+            self._new_level(self.base_block)
+
+        # New samples first complete the last bin when it is partial
+        level = self.levels[0]
+        block = self.base_block
+        head = -self.n_samples % block
+        bounds = np.arange(min(head, len(samples)) if head else 0, len(samples), block)
+        if head:
+            bounds = np.concatenate(([0], bounds))
+        mins = np.minimum.reduceat(samples, bounds) * scale
+        maxs = np.maximum.reduceat(samples, bounds) * scale
+        sumsq = np.add.reduceat(np.square(samples, dtype=np.float64), bounds) * scale ** 2
+        first = self.n_samples // block
+        if head:
+            mins[0] = min(mins[0], level["min"][first])
+            maxs[0] = max(maxs[0], level["max"][first])
+            sumsq[0] += level["sumsq"][first]
+        self.n_samples += len(samples)
+        self._store(level, first, mins, maxs, sumsq)
+
+        # Coarser levels, down to one of at most factor bins. A new level is
+        # computed whole.
+        k = 1
+        while k < len(self.levels) or self.levels[-1]["n"] > self.factor:
+            finer = self.levels[k - 1]
+            if k < len(self.levels):
+                level = self.levels[k]
+                first = first // self.factor
+            else:
+                level = self._new_level(finer["block"] * self.factor)
+                first = 0
+            bounds = np.arange(first * self.factor, finer["n"], self.factor)
+            self._store(level, first,
+                        np.minimum.reduceat(finer["min"][:finer["n"]], bounds),
+                        np.maximum.reduceat(finer["max"][:finer["n"]], bounds),
+                        np.add.reduceat(finer["sumsq"][:finer["n"]], bounds))
+            k += 1
+
+    def snapshot(self):
+        # Views of the current bins; they stay valid until the next append
+        levels = [{"block": level["block"], "min": level["min"][:level["n"]], "max": level["max"][:level["n"]],
+                   "rms": level["rms"][:level["n"]]} for level in self.levels]
+        return {"n_samples": self.n_samples, "levels": levels}
+
+class GrowingRTTMIndex:
+    # Columns of an RTTMIndex that turns are added to. Turns usually arrive
+    # in order of their start times and are appended; one that starts before
+    # the last one only re-sorts the turns from where it belongs.
+    def __init__(self):
+        self.n = 0
+        self.starts = np.empty(0, dtype=np.float64)
+        self.durations = np.empty(0, dtype=np.float64)
+        self.codes = np.empty(0, dtype=np.int32)
+        self.max_ends = np.empty(0, dtype=np.float64)
+        self.label_codes = {}
+
+    def extend(self, lines):
+        # Adds the SPEAKER lines and returns how many turns they held
+        starts, durations, codes = _parse_rttm_lines(lines, self.label_codes)
+        if len(starts) == 0:
+            return 0
+        # Existing turns keep their place before new ones with the same start
+        first = int(np.searchsorted(self.starts[:self.n], starts.min(), side='right'))
+        starts = np.concatenate((self.starts[first:self.n], starts))
+        durations = np.concatenate((self.durations[first:self.n], durations))
+        codes = np.concatenate((self.codes[first:self.n], codes))
+        order = np.argsort(starts, kind='stable')
+
+        end = first + len(starts)
+        for name in ("starts", "durations", "codes", "max_ends"):
+            setattr(self, name, _grown(getattr(self, name), end))
+        self.starts[first:end] = starts[order]
+        self.durations[first:end] = durations[order]
+        self.codes[first:end] = codes[order]
+        ends = self.starts[first:end] + self.durations[first:end]
+        if first:
+            ends[0] = max(ends[0], self.max_ends[first - 1])
+        self.max_ends[first:end] = np.maximum.accumulate(ends)
+        added = end - self.n
+        self.n = end
+        return added
+
+    def index(self):
+        # RTTMIndex over views of the columns, valid until the next extend
+        return RTTMIndex.from_sorted(self.starts[:self.n], self.durations[:self.n], self.codes[:self.n],
+                                     self.label_codes, self.max_ends[:self.n])
+
+class LiveRecording:
+    # A WAV/RTTM pair followed while it grows. update() reads what was
+    # appended to either file, and view() gives the plot data of the end of
+    # the recording. Only RTTM lines ending with a newline are read, since
+    # the last one may still be being written. A file that shrinks or is
+    # replaced is read again from its start.
+    def __init__(self, filename_wav, filename_rttm):
+        self.filename_wav = filename_wav
+        self.filename_rttm = filename_rttm
+        self.wav_identity = None
+        self.rttm_identity = None
+        self.reset_wav()
+        self.reset_rttm()
+
+    def reset_wav(self):
+        self.layout = None
+        self.samplerate = None
+        self.frames = 0
+        self.pyramid = GrowingPyramid()
+        self.tail = np.empty(2 * FOLLOW_TAIL_FRAMES, dtype=np.float32)
+        self.tail_length = 0
+
+    def reset_rttm(self):
+        self.rttm_offset = 0
+        self.rttm = GrowingRTTMIndex()
+
+    @property
+    def duration(self):
+        return self.frames / self.samplerate if self.samplerate else 0.0
+
+    def _append_tail(self, samples):
+        # The last FOLLOW_TAIL_FRAMES samples or more; older ones are moved
+        # out only when the buffer is full
+        samples = samples[-FOLLOW_TAIL_FRAMES:]
+        if self.tail_length + len(samples) > len(self.tail):
+            keep = FOLLOW_TAIL_FRAMES - len(samples)
+            self.tail[:keep] = self.tail[self.tail_length - keep:self.tail_length]
+            self.tail_length = keep
+        self.tail[self.tail_length:self.tail_length + len(samples)] = samples
+        self.tail_length += len(samples)
+
+    def _file_changes(self, filename, identity, read_so_far):
+        # (identity, grew, restarted) of the file now
+        stat = os.stat(filename)
+        current = (stat.st_dev, stat.st_ino)
+        restarted = identity is not None and (identity != current or stat.st_size < read_so_far)
+        return current, restarted or stat.st_size > read_so_far, restarted
+
+    def update(self, should_stop=None, timer=None):
+        # Returns whether anything was added
+        if self.layout is None:
+            read_so_far = 0
+        else:
+            read_so_far = self.layout["offset"] + self.frames * self.layout["dtype"].itemsize * self.layout["channels"]
+        self.wav_identity, wav_grew, restarted = self._file_changes(self.filename_wav, self.wav_identity, read_so_far)
+        if restarted:
+            self.reset_wav()
+        changed = False
+        if wav_grew:
+            with stage_span(timer, "follow_audio") as counters:
+                counters["samples"] = self._read_audio(should_stop)
+            changed = counters["samples"] > 0 or restarted
+
+        self.rttm_identity, rttm_grew, restarted = self._file_changes(self.filename_rttm, self.rttm_identity, self.rttm_offset)
+        if restarted:
+            self.reset_rttm()
+        if rttm_grew:
+            with stage_span(timer, "follow_rttm") as counters:
+                counters["turns"] = self._read_rttm()
+            changed = changed or counters["turns"] > 0 or restarted
+        return changed
+
+    def _read_audio(self, should_stop):
+        layout = wav_data_layout(self.filename_wav, growing=True)
+        if layout is None and not _wav_header_is_complete(self.filename_wav):
+            # No samples yet: read again once the file grows
+            return 0
+        if layout is None:
+            raise ValueError(f"{self.filename_wav}: only 16- and 32-bit PCM and float WAV files can be followed")
+        if self.layout is None:
+            self.samplerate = sf.info(self.filename_wav).samplerate
+        self.layout = layout
+        start_frame = self.frames
+        blocks, scale = native_blocks(self.filename_wav, start_frame, layout["frames"], should_stop=should_stop,
+                                      layout=layout)
+        for block in blocks:
+            self.pyramid.append(block, scale)
+            self._append_tail(block * scale)
+            self.frames += len(block)
+        return self.frames - start_frame
+
+    def _read_rttm(self):
+        with open(self.filename_rttm, 'rb') as file:
+            file.seek(self.rttm_offset)
+            appended = file.read()
+        complete = appended[:appended.rfind(b'\n') + 1]
+        self.rttm_offset += len(complete)
+        return self.rttm.extend(complete.decode().splitlines())
+
+    def view(self, window, pixel_width, timer=None):
+        # Plot data of the last window seconds, or of the whole recording
+        # while it is shorter. Views that need every sample are drawn from
+        # the tail, which holds enough of them for up to
+        # FOLLOW_TAIL_FRAMES // FILE_PYRAMID_BASE_BLOCK pixel columns.
+        pixel_width = min(max(int(pixel_width), 1), FOLLOW_TAIL_FRAMES // FILE_PYRAMID_BASE_BLOCK)
+        sr = self.samplerate or 1
+        n_samples = min(int(round(window * sr)), self.frames)
+        start_sample = self.frames - n_samples
+        start_time = start_sample / sr
+        with stage_span(timer, "split") as counters:
+            segments = self.rttm.index().segments(start_time, self.frames / sr)
+            counters["segments"] = len(segments[0])
+        tail_start = self.frames - self.tail_length
+        # A copy: the tail is shifted in place by the next update while the
+        # GUI thread may still be drawing the samples of this view
+        y = self.tail[start_sample - tail_start:self.tail_length].copy() if start_sample >= tail_start else None
+        with stage_span(timer, "plot_data") as counters:
+            data = waveform_plot_data(y, sr, segments, start_time, self.pyramid.snapshot(), start_sample,
+                                      pixel_width, n_samples)
+            counters["points"] = plot_data_points(data)
+        return data
+
+
+# Spectrogram: frames of SPECTROGRAM_N_FFT samples centred every hop samples,
+# where the hop is SPECTROGRAM_HOP times a power of two chosen so that a view
+# has about one frame per pixel column. Frames are computed and cached in
+# tiles of SPECTROGRAM_TILE_FRAMES consecutive frames of one hop.
+SPECTROGRAM_N_FFT = 512
+SPECTROGRAM_HOP = 128
+SPECTROGRAM_TILE_FRAMES = 256
+# Above this hop, frames are read one by one instead of as one block
+SPECTROGRAM_MAX_CONTIGUOUS_HOP = 4 * SPECTROGRAM_N_FFT
+# Range of the colour scale below the loudest frame of a view, in dB
+SPECTROGRAM_DYNAMIC_RANGE = 80.0
+
+def spectrogram_hop(n_samples, pixel_width):
+    ratio = max(n_samples / max(pixel_width, 1) / SPECTROGRAM_HOP, 1.0)
+    return SPECTROGRAM_HOP << int(np.ceil(np.log2(ratio)))
+
+def _read_padded(audio_file, start_frame, n_frames):
+    # Zeros stand in for the samples before the start and after the end
+    block = np.zeros(n_frames, dtype=np.float32)
+    lo = max(start_frame, 0)
+    hi = min(start_frame + n_frames, audio_file.frames)
+    if hi > lo:
+        block[lo - start_frame:hi - start_frame] = _read_frames(audio_file, lo, hi - lo)
+    return block
+
+def spectrogram_tile(filename, hop, tile):
+    # Magnitudes in dB of the frames of one tile, as a (bins, frames) array.
+    # Runs on a worker thread, so it opens its own SoundFile.
+    half = SPECTROGRAM_N_FFT // 2
+    centers = (tile * SPECTROGRAM_TILE_FRAMES + np.arange(SPECTROGRAM_TILE_FRAMES)) * hop
+    with sf.SoundFile(filename) as audio_file:
+        if hop <= SPECTROGRAM_MAX_CONTIGUOUS_HOP:
+            block = _read_padded(audio_file, int(centers[0]) - half, (SPECTROGRAM_TILE_FRAMES - 1) * hop + SPECTROGRAM_N_FFT)
+            frames = np.lib.stride_tricks.sliding_window_view(block, SPECTROGRAM_N_FFT)[::hop]
+        else:
+            frames = np.stack([_read_padded(audio_file, center - half, SPECTROGRAM_N_FFT) for center in centers.tolist()])
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(SPECTROGRAM_N_FFT).astype(np.float32), axis=1))
+    return np.ascontiguousarray((20 * np.log10(spectrum + 1e-10)).T, dtype=np.float32)
+
+def spectrogram_view(filename, start_time, end_time, pixel_width, cache, pool, should_stop=None):
+    # Spectrogram of [start_time, end_time) assembled from cached tiles. Only
+    # the missing tiles of the window are submitted to the thread pool, so the
+    # cost depends on the width of the plot and not on the length of the file.
+    info = sf.info(filename)
+    sr = info.samplerate
+    start_time = 0.0 if start_time is None else max(start_time, 0.0)
+    end_time = info.frames / sr if end_time is None else min(end_time, info.frames / sr)
+    hop = spectrogram_hop(max(end_time - start_time, 0.0) * sr, pixel_width)
+    first_frame = int(start_time * sr // hop)
+    last_frame = max(int(np.ceil(end_time * sr / hop)), first_frame + 1)
+    tiles = range(first_frame // SPECTROGRAM_TILE_FRAMES, (last_frame - 1) // SPECTROGRAM_TILE_FRAMES + 1)
+
+    identity = file_identity(filename)
+    images = {}
+    futures = {}
+    for tile in tiles:
+        image = cache.get(("stft", identity, hop, tile))
+        if image is None:
+            futures[tile] = pool.submit(spectrogram_tile, filename, hop, tile)
+        else:
+            images[tile] = image
+    try:
+        pending = set(futures.values())
+        while pending:
+            if should_stop is not None and should_stop():
+                raise LoadCancelled()
+            _, pending = wait(pending, timeout=0.05)
+    finally:
+        # Tiles nobody waits for any more are not computed
+        for future in futures.values():
+            future.cancel()
+    for tile, future in futures.items():
+        images[tile] = future.result()
+        cache.put(("stft", identity, hop, tile), images[tile], images[tile].nbytes)
+
+    offset = first_frame - tiles[0] * SPECTROGRAM_TILE_FRAMES
+    image = np.concatenate([images[tile] for tile in tiles], axis=1)[:, offset:offset + last_frame - first_frame]
+    return {
+        "image": image,
+        # Frame k is centred on sample k * hop
+        "extent": ((first_frame - 0.5) * hop / sr, (last_frame - 0.5) * hop / sr, 0.0, sr / 2),
+        "hop": hop,
+        "tiles": len(tiles),
+        "computed": len(futures),
+    }
+
+def draw_spectrogram(ax, spectrogram, colors):
+    # The spectrogram with a strip of label-coloured bars along its top edge,
+    # matching the colours of the waveform. spectrogram["bars"] holds the
+    # (starts, ends, codes) of spectrogram["labels"]. Returns the artists so
+    # that the next view can remove them.
+    image = spectrogram["image"]
+    loudest = float(image.max()) if image.size else 0.0
+    top = spectrogram["extent"][3]
+    artists = [ax.imshow(image, origin='lower', aspect='auto', extent=spectrogram["extent"], cmap='magma',
+                         vmin=loudest - SPECTROGRAM_DYNAMIC_RANGE, vmax=loudest, interpolation='nearest')]
+    starts, ends, codes = spectrogram["bars"]
+    fallback = matplotlib.colormaps['tab20']
+    facecolors = [colors.get(spectrogram["labels"][code], fallback(code % 20)) for code in codes.tolist()]
+    artists.append(ax.broken_barh(_bars(starts, ends), (top * 0.94, top * 0.06), facecolors=facecolors, linewidth=0))
+    ax.set_ylim(0, top)
+    ax.set_ylabel('Frequency (Hz)')
+    return artists